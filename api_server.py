@@ -1,4 +1,6 @@
-from app import webserver
+from app import create_app
+
+webserver = create_app()
 # Your code will go in the app/ directory.
 # Have a look in:
 #   * __init__.py
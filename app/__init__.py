@@ -1,33 +1,103 @@
+"""
+The webserver application.
+
+Importing the package is cheap: create_app() builds the server, and the dataset is
+loaded by a background thread, so the routes answer as soon as the app is created.
+"""
 from flask import Flask
-from app.data_ingestor import DataIngestor
 from app.task_runner import ThreadPool
+from app.result_cache import ResultCache
+from app.result_store import MemoryResultStore, FileResultStore
+from app.job_registry import JobRegistry
+from app.metrics import Metrics
+from app.dataset_loader import DatasetLoader
+from app.routes import api
+from app.serializer import JSONProvider
 
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from queue import SimpleQueue
 import time
+from os import environ
+
+DATASET_PATH = "./nutrition_activity_obesity_usa_subset.csv"
+
+def create_app() -> Flask:
+    """
+    Creates the webserver.
+
+    The job queue accepts jobs right away; they wait there until the dataset is
+    loaded, which GET /api/ready reports. POST /api/admin/reload reloads the dataset,
+    as does any change of the CSV file if DI_WATCH_INTERVAL is set; the admin routes are
+    only enabled if ADMIN_TOKEN is set.
+
+    Returns:
+        Flask: The webserver, with its routes registered and the dataset loading.
+    """
+    webserver = Flask(__name__)
+    webserver.json = JSONProvider(webserver)
+
+    webserver.logger = logging.getLogger('webserver')
+    setup_logging(webserver.logger, environ.get('LOG_FILE', 'webserver.log'))
+    webserver.poll_log_rate = float(environ.get('LOG_POLL_SAMPLE_RATE', 1))
+
+    webserver.logger.info('Start server')
+
+    if environ.get('RESULT_STORE') == 'file':
+        webserver.result_store = FileResultStore('results')
+    else:
+        webserver.result_store = MemoryResultStore(float(environ.get('RESULT_TTL', 3600)),
+                                                   int(environ.get('RESULT_STORE_SIZE', 100000)))
+
+    webserver.metrics = Metrics(int(environ.get('METRICS_WINDOW', 1024)))
+    webserver.job_registry = JobRegistry(webserver.metrics,
+                                         int(environ.get('JOB_HISTORY_SIZE', 100000)),
+                                         webserver.result_store)
+    webserver.tasks_runner = ThreadPool(webserver.job_registry, webserver.result_store)
+
+    webserver.shutdown = False
+    webserver.data_ingestor = None
+    webserver.result_cache = ResultCache(int(environ.get('RESULT_CACHE_SIZE', 128)))
+    webserver.admin_token = environ.get('ADMIN_TOKEN')
 
-webserver = Flask(__name__)
+    webserver.dataset_loader = DatasetLoader(webserver, DATASET_PATH)
+    webserver.dataset_loader.load()
+    if environ.get('DI_WATCH_INTERVAL'):
+        webserver.dataset_loader.watch(float(environ.get('DI_WATCH_INTERVAL')))
 
-webserver.logger = logging.getLogger('webserver')
-webserver.logger.setLevel(logging.INFO)
-log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                               datefmt='%Y-%m-%d %H:%M:%S')
+    webserver.sync_fast_path = environ.get('SYNC_FAST_PATH') == '1'
+    webserver.sync_cost_threshold = int(environ.get('SYNC_COST_THRESHOLD', 20000))
 
-log_format.converter = time.gmtime
+    webserver.register_blueprint(api)
+    return webserver
 
-log_file = 'webserver.log'
-log_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
-log_handler.setFormatter(log_format)
-webserver.logger.addHandler(log_handler)
+def setup_logging(logger: logging.Logger, log_file: str):
+    """
+    Sends the records of a logger to a log file through a queue.
 
-webserver.logger.info(f'Start server')
+    The request threads only put the records in the queue; a QueueListener thread
+    writes them to the rotating log file, so file I/O and rotation stay out of the
+    request path. Pending records are written when the process exits.
 
-webserver.tasks_runner = ThreadPool([])
+    Args:
+        logger (logging.Logger): The logger of the webserver.
+        log_file (str): The path to the log file, set by LOG_FILE (webserver.log in the
+            current directory by default).
+    """
+    if logger.handlers:
+        return
+    logger.setLevel(logging.INFO)
+    log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                                   datefmt='%Y-%m-%d %H:%M:%S')
 
-# webserver.task_runner.start()
-webserver.shutdown = False
-webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
+    log_format.converter = time.gmtime
 
-webserver.job_counter = 1
+    log_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
+    log_handler.setFormatter(log_format)
 
-from app import routes
+    log_queue = SimpleQueue()
+    listener = QueueListener(log_queue, log_handler)
+    logger.addHandler(QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
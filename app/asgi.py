@@ -0,0 +1,284 @@
+"""
+Module for the ASGIApp class, which serves the routes of the webserver from an asyncio
+event loop, for ASGI servers such as uvicorn.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import asyncio
+import random
+import re
+import sys
+from urllib.parse import parse_qs
+
+try:
+    from .routes import MAX_RESULT_WAIT
+    from .serializer import dumps
+except ImportError:
+    # Imported as a top-level module, by the unit tests
+    from routes import MAX_RESULT_WAIT
+    from serializer import dumps
+
+GET_RESULTS = re.compile(r'/api/get_results/(\d+)')
+
+class ASGIApp:
+    """
+    An ASGI application serving the routes of a webserver created by create_app().
+
+    GET /api/get_results/<job_id> is served by a coroutine: a long-polling client
+    ('?wait=<seconds>') awaits a future resolved by the thread that ends the job, so
+    waiting clients do not hold a thread each. The other routes are cheap or only
+    queue jobs, so they are run by the Flask application in a small thread pool, and
+    the jobs are still computed by the tasks runner of the webserver, which is shut down
+    along with the ASGI server.
+
+    Attributes:
+        webserver (Flask): The webserver, sharing its jobs and results with this app.
+        executor (ThreadPoolExecutor): Runs the Flask routes.
+
+    Methods:
+        get_results(scope: dict, send: function, job_id: int): Serves a job result.
+        wait(job_id: int, timeout: float): Awaits the end of a job.
+        call_flask(scope: dict, receive: function, send: function): Serves a request
+            through the Flask application.
+    """
+
+    def __init__(self, webserver, threads: int):
+        self.webserver = webserver
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope: dict, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    # Like /api/graceful_shutdown: the TaskRunner threads would otherwise
+                    # keep the process alive
+                    self.webserver.shutdown = True
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.executor, self.webserver.tasks_runner.shutdown)
+                    self.executor.shutdown(wait=False)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        match = GET_RESULTS.fullmatch(scope['path'])
+        if match is not None and scope['method'] == 'GET':
+            await self.get_results(scope, send, int(match.group(1)))
+        else:
+            await self.call_flask(scope, receive, send)
+
+    async def get_results(self, scope: dict, send, job_id: int):
+        """
+        Serves GET /api/get_results/<job_id> like the Flask route, awaiting the end of
+        the job instead of blocking a thread when the request has '?wait=<seconds>'.
+
+        Args:
+            scope (dict): The ASGI scope of the request.
+            send (function): The ASGI send function.
+            job_id (int): The ID of the job.
+        """
+        webserver = self.webserver
+        url = request_url(scope)
+        if webserver.shutdown:
+            webserver.logger.error('GET %s - server down', url)
+            await send_json(send, {"status": "server down"})
+            return
+
+        if random.random() < webserver.poll_log_rate:
+            webserver.logger.info('GET %s', url)
+
+        job = webserver.job_registry.get(job_id)
+        if job is None:
+            await send_json(send, {"status": "error", "reason" : "Invalid job_id"})
+            return
+
+        # The result store may read files, so it is only called from the thread pool
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, webserver.result_store.stream,
+                                            job_id)
+        try:
+            wait = float(parse_qs(scope['query_string'].decode('latin-1'))['wait'][0])
+        except (KeyError, ValueError):
+            wait = None
+        if result is None and wait:
+            await self.wait(job_id, min(wait, MAX_RESULT_WAIT))
+            result = await loop.run_in_executor(self.executor, webserver.result_store.stream,
+                                                job_id)
+
+        if result is None:
+            if job.status == 'running':
+                await send_json(send, {'status': 'running'})
+            else:
+                await send_json(send, {
+                    "status": "error",
+                    "reason": "Job failed" if job.status == 'error' else "Result expired"})
+            return
+
+        length, chunks = result
+        chunks = iter(chunks)
+        prefix = b'{"status": "done", "data": '
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', b'%d' % (len(prefix) + length + 1))]})
+        await send({'type': 'http.response.body', 'body': prefix, 'more_body': True})
+        try:
+            while (chunk := await loop.run_in_executor(self.executor, next, chunks,
+                                                       None)) is not None:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            # Closes the file of a streamed result, even if the client went away
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        await send({'type': 'http.response.body', 'body': b'}'})
+
+    async def wait(self, job_id: int, timeout: float):
+        """
+        Awaits the end of a job, or the timeout, without blocking a thread. The callback
+        waking it up is unregistered when it stops waiting, be it on the timeout or
+        because the request was cancelled.
+
+        Args:
+            job_id (int): The ID of the job.
+            timeout (float): The maximum number of seconds to wait.
+        """
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def wake_up():
+            # Called by the thread ending the job
+            try:
+                loop.call_soon_threadsafe(
+                    lambda: finished.done() or finished.set_result(None))
+            except RuntimeError:
+                # The event loop is closed, so nobody is waiting anymore
+                pass
+
+        job_registry = self.webserver.job_registry
+        if job_registry.add_done_callback(job_id, wake_up):
+            try:
+                await asyncio.wait_for(finished, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                job_registry.remove_done_callback(job_id, wake_up)
+
+    async def call_flask(self, scope: dict, receive, send):
+        """
+        Serves a request through the Flask application (a WSGI application), run in
+        the thread pool.
+
+        Args:
+            scope (dict): The ASGI scope of the request.
+            receive (function): The ASGI receive function.
+            send (function): The ASGI send function.
+        """
+        body = BytesIO()
+        while True:
+            message = await receive()
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        status, headers, content = await asyncio.get_running_loop().run_in_executor(
+            self.executor, run_wsgi, self.webserver, wsgi_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+async def send_json(send, obj: dict):
+    """
+    Sends a JSON response, encoded as jsonify() does.
+
+    Args:
+        send (function): The ASGI send function.
+        obj (dict): The body of the response.
+    """
+    body = dumps(obj, sort_keys=True) + b'\n'
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', b'%d' % len(body))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+def request_url(scope: dict) -> str:
+    """
+    Returns the URL of a request, as Flask's request.url.
+
+    Args:
+        scope (dict): The ASGI scope of the request.
+
+    Returns:
+        str: The URL.
+    """
+    host = dict(scope['headers']).get(b'host', b'localhost').decode('latin-1')
+    url = f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}{scope['path']}"
+    if scope['query_string']:
+        url += '?' + scope['query_string'].decode('latin-1')
+    return url
+
+def wsgi_environ(scope: dict, body: BytesIO) -> dict:
+    """
+    Builds the WSGI environ of an ASGI HTTP request.
+
+    Args:
+        scope (dict): The ASGI scope of the request.
+        body (BytesIO): The body of the request.
+
+    Returns:
+        dict: The WSGI environ.
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    # The body was read as a whole, even if it was sent in chunks
+    environ['CONTENT_LENGTH'] = str(body.getbuffer().nbytes)
+    return environ
+
+def run_wsgi(wsgi_app, environ: dict) -> tuple:
+    """
+    Calls a WSGI application and collects its response.
+
+    Args:
+        wsgi_app (function): The WSGI application.
+        environ (dict): The WSGI environ of the request.
+
+    Returns:
+        tuple: The status code, the headers as ASGI (name, value) byte pairs and the body.
+    """
+    response = {}
+
+    def start_response(status: str, headers: list, exc_info=None): # pylint: disable=unused-argument
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+
+    content = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(content)
+    finally:
+        if hasattr(content, 'close'):
+            content.close()
+    return response['status'], response['headers'], body
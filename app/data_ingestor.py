@@ -1,15 +1,80 @@
 """
 This module contains a class that represents a data ingestor for statistical data.
 """
+from os import stat
 import json
+import logging
+import time
 import pandas as pd
 
-class DataIngestor:
+try:
+    from .shared_dataset import attach_frame, publish_frame
+    from .snapshot import load_snapshot, save_snapshot
+    from .serializer import series_dict, series_json
+except ImportError:
+    # Imported as a top-level module, by the unit tests and the benchmarks
+    from shared_dataset import attach_frame, publish_frame
+    from snapshot import load_snapshot, save_snapshot
+    from serializer import series_dict, series_json
+
+# Columns, besides 'Question', that identify one cell of the aggregate index
+INDEX_KEYS = ['LocationDesc', 'StratificationCategory1', 'Stratification1',
+              'YearStart', 'YearEnd']
+
+# String columns that are dictionary-encoded in compact mode
+ENCODED_COLUMNS = ['Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1']
+
+# Numeric columns read by the endpoints
+NUMERIC_COLUMNS = ['Data_Value', 'YearStart', 'YearEnd']
+
+# The only columns any endpoint reads; the rest are dropped in compact mode
+USED_COLUMNS = ENCODED_COLUMNS + NUMERIC_COLUMNS
+
+# Relative cost of reducing one index cell for every endpoint: scalar results are the
+# cheapest, results grouped by state or by category need a groupby and a bigger output
+REDUCTION_WEIGHTS = {
+    'state_mean': 1,
+    'global_mean': 1,
+    'state_diff_from_mean': 2,
+    'state_mean_by_category': 4,
+    'states_mean': 4,
+    'best5': 4,
+    'worst5': 4,
+    'diff_from_mean': 4,
+    'mean_by_category': 8,
+}
+
+# Endpoints taking a state after the question; the other ones only take the question
+STATE_ENDPOINTS = ['state_mean', 'state_diff_from_mean', 'state_mean_by_category']
+
+class DataIngestor: # pylint: disable=too-many-public-methods,too-many-instance-attributes
     """
     A class that represents a data ingestor for statistical data.
 
     Attributes:
         csv_path (str): The path to the CSV file containing the data.
+        compact (bool): Whether the dataset is kept in compact form: unused columns dropped,
+            string columns dictionary-encoded as categoricals and numeric columns downcast.
+        shared_memory (str): The name of a shared memory segment holding the dataset. The
+            first process to load the dataset publishes it there, and the other ones attach
+            to it instead of parsing the CSV file and holding a copy of their own.
+        segment (SharedMemory): The shared memory segment backing d_f, or None.
+        generation (str): The version of the CSV file the dataset was read from (its
+            modification time and size), or None if the file was not found. It is stored
+            in the shared memory segment, and checked by the processes attaching to it.
+        snapshot_dir (str): The directory holding the binary snapshots of the dataset, or
+            None. The dataset is loaded from the snapshot of the current version of the
+            CSV file if there is one, and a snapshot is saved after parsing otherwise.
+        loaded_from (str): Where the dataset was loaded from: 'csv', 'snapshot' or
+            'shared memory'.
+        load_time (float): Seconds spent loading the dataset.
+        memory_usage (tuple): Bytes used by the dataset right after parsing or loading
+            the snapshot (0 if attached to a shared memory segment) and once loaded.
+        index (dict): Maps every question to a DataFrame holding the sum and count of
+            'Data_Value' for each (LocationDesc, StratificationCategory1, Stratification1,
+            YearStart, YearEnd) cell. Built once at load time, so every request is a
+            dictionary lookup plus a small reduction instead of a full-table scan.
+        index_build_time (float): Seconds spent building the index.
 
     Methods:
         states_mean(question: str) -> str:
@@ -42,9 +107,54 @@ class DataIngestor:
         state_mean_by_category(question: str, state: str) -> str:
             Returns a JSON string containing the mean values of 'Data_Value' grouped by
             'StratificationCategory1' and 'Stratification1' for a given 'question' and 'state'.
+
+        batch(*queries: tuple) -> function:
+            Answers several requests in a single job.
+
+        append_rows(d_f: pd.DataFrame) -> DataIngestor:
+            Returns a copy of the dataset with new rows appended and the index updated.
     """
-    def __init__(self, csv_path: str):
-        self.d_f = pd.read_csv(csv_path)
+    def __init__(self, csv_path: str, compact: bool = False, shared_memory: str = None,
+                 snapshot_dir: str = None):
+        self.shared_memory = shared_memory
+        self.snapshot_dir = snapshot_dir
+        self.segment = None
+        self.generation = self.csv_version(csv_path)
+        start = time.perf_counter()
+        if shared_memory is not None:
+            try:
+                self.segment, self.d_f = attach_frame(shared_memory, self.generation) \
+                    or (None, None)
+            except ValueError:
+                # The segment is stale, and its name is taken: use a private copy
+                logging.getLogger('webserver').exception('Could not attach to %s',
+                                                         shared_memory)
+                self.shared_memory = shared_memory = None
+
+        if self.segment is not None:
+            self.loaded_from = 'shared memory'
+            parsed_size = 0
+        else:
+            self.d_f = self.read_dataset(csv_path, snapshot_dir)
+            parsed_size = self.d_f.memory_usage(deep=True).sum()
+            if compact:
+                self.d_f = self.compact_frame(self.d_f)
+            if shared_memory is not None:
+                try:
+                    self.segment, self.d_f = publish_frame(shared_memory,
+                                                           self.encoded_frame(self.d_f),
+                                                           self.generation)
+                except ValueError:
+                    # Another process published another version of the dataset first
+                    logging.getLogger('webserver').exception('Could not publish to %s',
+                                                             shared_memory)
+                    self.shared_memory = None
+        self.memory_usage = (parsed_size, self.d_f.memory_usage(deep=True).sum())
+        self.load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.index = self.build_index(self.d_f)
+        self.index_build_time = time.perf_counter() - start
 
         self.questions_best_is_min = [
             'Percent of adults aged 18 years and older who have an overweight classification',
@@ -61,6 +171,278 @@ class DataIngestor:
             'Percent of adults who engage in muscle-strengthening activities on 2 or more days a week',
         ]
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.segment is not None:
+            # Worker processes attach to the segment instead of receiving a copy
+            state['segment'] = state['d_f'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared_memory is not None and self.d_f is None:
+            attached = attach_frame(self.shared_memory, self.generation)
+            if attached is None:
+                # The dataset was not sent along, so there is no private copy to use
+                raise ValueError(f'Shared dataset {self.shared_memory} no longer exists')
+            self.segment, self.d_f = attached
+
+    @staticmethod
+    def csv_version(csv_path: str) -> str:
+        """
+        Identify the version of a CSV file by its modification time and size.
+
+        Parameters:
+            csv_path (str): The path to the CSV file.
+
+        Returns:
+            str: '<mtime in ns>-<size>', or None if the file cannot be found.
+        """
+        try:
+            csv_stat = stat(csv_path)
+        except OSError:
+            return None
+        return f'{csv_stat.st_mtime_ns}-{csv_stat.st_size}'
+
+    def read_dataset(self, csv_path: str, snapshot_dir: str) -> pd.DataFrame:
+        """
+        Read the dataset from its snapshot, or parse the CSV file and save a snapshot
+        of it for the next start.
+
+        Parameters:
+            csv_path (str): The path to the CSV file.
+            snapshot_dir (str): The directory holding the snapshots, or None.
+
+        Returns:
+            pd.DataFrame: The dataset.
+        """
+        if snapshot_dir is not None:
+            d_f = load_snapshot(snapshot_dir, csv_path)
+            if d_f is not None:
+                self.loaded_from = 'snapshot'
+                return d_f
+
+        self.loaded_from = 'csv'
+        d_f = pd.read_csv(csv_path)
+        if snapshot_dir is not None:
+            try:
+                save_snapshot(snapshot_dir, csv_path, self.encoded_frame(d_f))
+            except OSError:
+                logging.getLogger('webserver').exception('Could not save the dataset snapshot')
+        return d_f
+
+    @staticmethod
+    def encoded_frame(d_f: pd.DataFrame) -> pd.DataFrame:
+        """
+        Keep only the columns used by the endpoints, with the strings dictionary-encoded
+        as categoricals (integer codes plus a lookup table of distinct values).
+
+        Parameters:
+            d_f (pd.DataFrame): The dataset.
+
+        Returns:
+            pd.DataFrame: The encoded dataset.
+        """
+        return d_f[USED_COLUMNS].astype({column: 'category' for column in ENCODED_COLUMNS})
+
+    @staticmethod
+    def compact_frame(d_f: pd.DataFrame) -> pd.DataFrame:
+        """
+        Shrink the dataset to the columns used by the endpoints, in their smallest dtypes.
+
+        Strings become categoricals (integer codes plus a lookup table of distinct values),
+        so equality filters compare small integers. Data_Value is stored as float32, so
+        results may differ from the full-precision ones in the last few digits.
+
+        Parameters:
+            d_f (pd.DataFrame): The dataset, as parsed from the CSV file.
+
+        Returns:
+            pd.DataFrame: The compact dataset.
+        """
+        d_f = DataIngestor.encoded_frame(d_f)
+        d_f['Data_Value'] = d_f['Data_Value'].astype('float32')
+        d_f['YearStart'] = pd.to_numeric(d_f['YearStart'], downcast='integer')
+        d_f['YearEnd'] = pd.to_numeric(d_f['YearEnd'], downcast='integer')
+        return d_f
+
+    @staticmethod
+    def build_index(d_f: pd.DataFrame) -> dict:
+        """
+        Build the per-question aggregate index of the dataset.
+
+        Parameters:
+            d_f (pd.DataFrame): The raw dataset.
+
+        Returns:
+            dict: question -> DataFrame indexed by INDEX_KEYS with 'sum' and 'count' columns.
+        """
+        aggregates = d_f['Data_Value'].astype('float64') \
+            .groupby([d_f[key] for key in ['Question'] + INDEX_KEYS],
+                     dropna=False, observed=True) \
+            .agg(['sum', 'count'])
+        return {question: group.droplevel('Question')
+                for question, group in aggregates.groupby(level='Question')}
+
+    def append_rows(self, d_f: pd.DataFrame) -> 'DataIngestor':
+        """
+        Append new rows to the dataset without parsing it again or rebuilding the index.
+
+        The index of the new rows is built on its own, and the sums and counts of every
+        cell they touch are added to the existing ones, so only the questions of the new
+        rows are re-reduced, over their index cells. The result is a new DataIngestor:
+        this one is left unchanged, so the jobs running on it are not affected. The new
+        dataset is a private copy, no longer backed by a shared memory segment.
+
+        Parameters:
+            d_f (pd.DataFrame): The new rows, with at least the columns in USED_COLUMNS.
+
+        Returns:
+            DataIngestor: The dataset with the rows appended.
+
+        Raises:
+            ValueError: If a column used by the endpoints is missing from the new rows, or
+                a value of a numeric one is not a number.
+        """
+        missing = [column for column in USED_COLUMNS if column not in d_f.columns]
+        if missing:
+            raise ValueError(f'Missing columns: {", ".join(missing)}')
+        d_f = d_f.reindex(columns=self.d_f.columns)
+        for column in NUMERIC_COLUMNS:
+            try:
+                d_f[column] = pd.to_numeric(d_f[column], errors='raise')
+            except (ValueError, TypeError) as error:
+                raise ValueError(f'Invalid {column}: {error}') from error
+
+        columns = {}
+        for column in self.d_f.columns:
+            old, new = self.d_f[column], d_f[column]
+            if isinstance(old.dtype, pd.CategoricalDtype):
+                # Merging the categories only remaps the integer codes of the old rows
+                columns[column] = pd.api.types.union_categoricals(
+                    [old.array, pd.Categorical(new)], sort_categories=True)
+                continue
+            if (pd.api.types.is_float_dtype(old.dtype)
+                    and pd.api.types.is_numeric_dtype(new.dtype)) or (
+                        pd.api.types.is_integer_dtype(old.dtype)
+                        and pd.api.types.is_integer_dtype(new.dtype)):
+                # Keep the dtypes of compact mode
+                new = new.astype(old.dtype)
+            columns[column] = pd.concat([old, new], ignore_index=True)
+        appended_frame = pd.DataFrame(columns)
+
+        index = dict(self.index)
+        new_rows = appended_frame.iloc[len(self.d_f):]
+        for question, new_aggregates in self.build_index(new_rows).items():
+            if question in index:
+                new_aggregates = pd.concat([index[question], new_aggregates]) \
+                    .groupby(level=INDEX_KEYS, dropna=False, observed=True).sum()
+            index[question] = new_aggregates
+
+        appended = object.__new__(DataIngestor)
+        appended.__dict__.update(self.__dict__, d_f=appended_frame, index=index,
+                                 shared_memory=None, segment=None)
+        appended.memory_usage = (self.memory_usage[0],
+                                 appended_frame.memory_usage(deep=True).sum())
+        return appended
+
+    def aggregates(self, question: str) -> pd.DataFrame:
+        """
+        Return the aggregate index rows of a question (empty if the question is unknown).
+
+        Parameters:
+            question (str): The question to look up.
+
+        Returns:
+            pd.DataFrame: The 'sum' and 'count' of every index cell of the question.
+        """
+        aggregates = self.index.get(question)
+        if aggregates is None:
+            aggregates = pd.DataFrame(
+                {'sum': pd.Series(dtype='float64'), 'count': pd.Series(dtype='int64')},
+                index=pd.MultiIndex.from_tuples([], names=INDEX_KEYS))
+        return aggregates
+
+    @staticmethod
+    def grouped_mean(aggregates: pd.DataFrame, keys: list) -> pd.Series:
+        """
+        Reduce index cells to the mean of 'Data_Value' grouped by some of the index keys.
+
+        Parameters:
+            aggregates (pd.DataFrame): Index cells, as returned by aggregates().
+            keys (list): The index levels to group by.
+
+        Returns:
+            pd.Series: The mean value of every group, sorted by group key.
+        """
+        totals = aggregates.groupby(level=keys).sum()
+        return (totals['sum'] / totals['count']).rename('Data_Value')
+
+    @staticmethod
+    def total_mean(aggregates: pd.DataFrame) -> float:
+        """
+        Reduce index cells to a single mean of 'Data_Value'.
+
+        Parameters:
+            aggregates (pd.DataFrame): Index cells, as returned by aggregates().
+
+        Returns:
+            float: The mean value, or NaN if there are no values.
+        """
+        count = aggregates['count'].sum()
+        return aggregates['sum'].sum() / count if count else float('nan')
+
+    def state_aggregates(self, question: str, state: str) -> pd.DataFrame:
+        """
+        Return the aggregate index rows of a question restricted to a single state.
+
+        Parameters:
+            question (str): The question to look up.
+            state (str): The state to look up.
+
+        Returns:
+            pd.DataFrame: The index cells of the state, without the 'LocationDesc' level.
+        """
+        aggregates = self.aggregates(question)
+        try:
+            # The index is sorted, so this is a binary search on its first level
+            return aggregates.xs(state, level='LocationDesc')
+        except KeyError:
+            return aggregates.iloc[:0].droplevel('LocationDesc')
+
+    def estimate_cost(self, endpoint: str, *args) -> int:
+        """
+        Estimate the cost of a request as the weighted number of index cells it reduces.
+
+        Parameters:
+            endpoint (str): The name of the method serving the request, e.g. 'state_mean'.
+            *args: The arguments of the request; the question comes first.
+
+        Returns:
+            int: The estimated cost of the request.
+        """
+        if endpoint == 'batch':
+            return sum(self.estimate_cost(*query) for query in args)
+        return REDUCTION_WEIGHTS[endpoint] * len(self.aggregates(args[0]))
+
+    @staticmethod
+    def cost_class(endpoint: str, *args) -> int:
+        """
+        Classify a request by the reduction weight of its endpoint, independently of the
+        dataset: 0 for scalar results, up to 3 for mean_by_category. A batch is in the
+        class of its most expensive query.
+
+        Parameters:
+            endpoint (str): The name of the method serving the request, e.g. 'state_mean'.
+            *args: The arguments of the request; the queries of a batch.
+
+        Returns:
+            int: The binary logarithm of the reduction weight of the request.
+        """
+        if endpoint == 'batch':
+            return max((DataIngestor.cost_class(*query) for query in args), default=0)
+        return REDUCTION_WEIGHTS[endpoint].bit_length() - 1
+
     def states_mean(self, question: str) -> str:
         """
         Calculate the mean of the 'Data_Value' column for a given question,
@@ -72,8 +454,9 @@ class DataIngestor:
         Returns:
             str: The mean values for each location in JSON format.
         """
-        return lambda : self.d_f.loc[self.d_f['Question'] == question] \
-            .groupby('LocationDesc')['Data_Value'].mean().sort_values(ascending=True).to_json()
+        return lambda : series_json(
+            self.grouped_mean(self.aggregates(question), ['LocationDesc'])
+            .sort_values(ascending=True))
 
     def state_mean(self, question: str, state: str) -> str:
         """
@@ -87,8 +470,7 @@ class DataIngestor:
         - str: A JSON string containing the mean value of the question for the state.
         """
         return lambda : json.dumps({
-            state : self.d_f.loc[(self.d_f['Question'] == question)
-                              & (self.d_f['LocationDesc'] == state)]['Data_Value'].mean()
+            state : self.total_mean(self.state_aggregates(question, state))
         })
 
     def best5(self, question: str) -> str:
@@ -102,9 +484,9 @@ class DataIngestor:
         Returns:
             str: A JSON string containing the top 5 locations and their average data values.
         """
-        return lambda : self.d_f.loc[self.d_f['Question'] == question] \
-            .groupby('LocationDesc')['Data_Value'].mean() \
-        .sort_values(ascending=(question in self.questions_best_is_min)).head(5).to_json()
+        return lambda : series_json(
+            self.grouped_mean(self.aggregates(question), ['LocationDesc'])
+            .sort_values(ascending=(question in self.questions_best_is_min)).head(5))
 
     def worst5(self, question: str) -> str:
         """
@@ -116,11 +498,15 @@ class DataIngestor:
         Returns:
             str: A JSON string containing the worst 5 locations and their average data values.
         """
-        return lambda : self.d_f.loc[(self.d_f['Question'] == question)
-                                   & (self.d_f['YearStart'] >= 2011)
-                                   & (self.d_f['YearEnd'] <= 2022)] \
-            .groupby('LocationDesc')['Data_Value'].mean() \
-        .sort_values(ascending=(question in self.questions_best_is_max)).head(5).to_json()
+        def aux():
+            aggregates = self.aggregates(question)
+            in_range = (aggregates.index.get_level_values('YearStart') >= 2011) \
+                & (aggregates.index.get_level_values('YearEnd') <= 2022)
+            return series_json(
+                self.grouped_mean(aggregates[in_range], ['LocationDesc'])
+                .sort_values(ascending=(question in self.questions_best_is_max)).head(5))
+
+        return aux
 
     def global_mean(self, question: str) -> str:
         """
@@ -140,7 +526,7 @@ class DataIngestor:
         ```
         """
         return lambda: json.dumps({
-            "global_mean": self.d_f.loc[self.d_f['Question'] == question]['Data_Value'].mean()
+            "global_mean": self.total_mean(self.aggregates(question))
         })
 
     def diff_from_mean(self, question: str) -> str:
@@ -155,10 +541,9 @@ class DataIngestor:
         """
 
         def aux():
-            global_mean = self.d_f.loc[self.d_f['Question'] == question]['Data_Value'].mean()
-            return self.d_f.loc[self.d_f['Question'] == question] \
-                .groupby('LocationDesc')['Data_Value'].apply(lambda x: global_mean - x.mean()) \
-                .to_json()
+            aggregates = self.aggregates(question)
+            global_mean = self.total_mean(aggregates)
+            return series_json(global_mean - self.grouped_mean(aggregates, ['LocationDesc']))
 
         return aux
 
@@ -180,12 +565,9 @@ class DataIngestor:
             print(diff)  # Output: {"California": -0.5}
         """
         def aux():
-            global_mean = self.d_f.loc[self.d_f['Question'] == question]['Data_Value'].mean()
             return json.dumps({
-                state : global_mean -
-                self.d_f.loc[(self.d_f['Question'] == question)
-                          & (self.d_f['LocationDesc'] == state)]['Data_Value']
-                          .mean()
+                state : self.total_mean(self.aggregates(question)) -
+                self.total_mean(self.state_aggregates(question, state))
             })
         return aux
 
@@ -209,10 +591,10 @@ class DataIngestor:
         Note: The returned function should be called to get the mean by category.
         """
         def aux():
-            return self.d_f.loc[self.d_f['Question'] == question] \
-                .groupby(['LocationDesc',
-                          'StratificationCategory1',
-                          'Stratification1'])['Data_Value'].mean().to_json()
+            return series_json(self.grouped_mean(self.aggregates(question),
+                                                 ['LocationDesc',
+                                                  'StratificationCategory1',
+                                                  'Stratification1']))
         return aux
 
     def state_mean_by_category(self, question: str, state: str) -> str:
@@ -229,10 +611,25 @@ class DataIngestor:
             and 'Stratification1'.
         """
         def aux():
+            # The nested object is built directly, instead of parsing to_json()
             return json.dumps({
-                state : json.loads(self.d_f.loc[(self.d_f['Question'] == question)
-                                & (self.d_f['LocationDesc'] == state)]
-                .groupby(['StratificationCategory1', 'Stratification1'])['Data_Value']
-                .mean().to_json())
+                state : series_dict(self.grouped_mean(self.state_aggregates(question, state),
+                                                      ['StratificationCategory1',
+                                                       'Stratification1']))
                 })
         return aux
+
+    def batch(self, *queries: tuple) -> str:
+        """
+        Answers several requests in a single job, by calling the method of each of them.
+
+        Parameters:
+            *queries (tuple): One (endpoint, question) or (endpoint, question, state) tuple
+            per request, where endpoint is the name of one of the methods above.
+
+        Returns:
+            function: A function returning a JSON list with the result of every request,
+            in the order of the queries.
+        """
+        jobs = [getattr(self, endpoint)(*args) for endpoint, *args in queries]
+        return lambda: '[' + ','.join(job() for job in jobs) + ']'
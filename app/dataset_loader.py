@@ -0,0 +1,179 @@
+"""
+Module for the DatasetLoader class, which loads the dataset of the webserver in the
+background and swaps in a new one when the CSV file is reloaded or rows are appended.
+"""
+from threading import Thread, Lock
+from os import environ, stat
+import io
+import time
+
+class DatasetLoader:
+    """
+    Loads the dataset of the webserver in a background thread.
+
+    A reload builds a complete new DataIngestor, index included, while the current one
+    keeps answering requests, and then swaps it in: the jobs already running finish on
+    the old dataset, the following ones use the new one, and the result cache is
+    cleared. Appending rows is swapped in the same way, without parsing the CSV file
+    again.
+
+    Attributes:
+        webserver (Flask): The webserver the dataset is loaded for.
+        csv_path (str): The path to the CSV file.
+        thread (Thread): The thread running the last load, or None.
+        lock (Lock): Protects thread, and serializes appends with the loads.
+        mtime (int): The modification time of the CSV file, in nanoseconds, as last
+            seen by the watcher or left by an append.
+
+    Methods:
+        load() -> bool: Starts loading the dataset, unless a load is running.
+        join(timeout: float): Waits for the running load to end.
+        append(csv_text: str) -> int: Appends CSV rows to the dataset and the file.
+        watch(interval: float): Reloads the dataset whenever the CSV file changes.
+    """
+
+    def __init__(self, webserver, csv_path: str):
+        self.webserver = webserver
+        self.csv_path = csv_path
+        self.thread = None
+        self.lock = Lock()
+        self.mtime = None
+
+    @property
+    def loading(self) -> bool:
+        """
+        Whether a load is running.
+        """
+        thread = self.thread
+        return thread is not None and thread.is_alive()
+
+    def load(self) -> bool:
+        """
+        Starts loading the dataset in a background thread.
+
+        Returns:
+            bool: False if a load was already running, in which case none is started.
+        """
+        with self.lock:
+            if self.loading:
+                return False
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return True
+
+    def join(self, timeout: float = None):
+        """
+        Waits for the running load, if any, to end.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, or None.
+        """
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def run(self):
+        """
+        Loads the dataset and swaps it in.
+
+        The first load publishes the dataset to the DI_SHARED_MEMORY segment, if set;
+        reloads do not, since the processes attached to the segment keep the old one.
+        If there is no dataset to keep answering from when the load fails, the jobs
+        queued meanwhile, and the next ones, fail until a reload succeeds.
+        """
+        # Imported here, so importing the package does not import pandas
+        from app.data_ingestor import DataIngestor # pylint: disable=import-outside-toplevel
+
+        webserver = self.webserver
+        reload = webserver.data_ingestor is not None
+        try:
+            data_ingestor = DataIngestor(
+                self.csv_path, compact=environ.get('DI_COMPACT_DATASET') == '1',
+                shared_memory=None if reload else environ.get('DI_SHARED_MEMORY'),
+                snapshot_dir=environ.get('DI_SNAPSHOT_DIR'))
+        except Exception: # pylint: disable=broad-exception-caught
+            webserver.logger.exception('Could not load the dataset')
+            if not reload:
+                webserver.tasks_runner.set_data_ingestor(None)
+            return
+
+        webserver.logger.info('Loaded dataset from %s in %.3f s',
+                              data_ingestor.loaded_from, data_ingestor.load_time)
+        webserver.logger.info('Dataset uses %d bytes (%d bytes as parsed)',
+                              data_ingestor.memory_usage[1], data_ingestor.memory_usage[0])
+        webserver.logger.info('Built aggregate index for %d questions in %.3f s',
+                              len(data_ingestor.index), data_ingestor.index_build_time)
+
+        webserver.tasks_runner.set_data_ingestor(data_ingestor)
+        webserver.data_ingestor = data_ingestor
+        if reload:
+            webserver.result_cache.clear()
+            webserver.logger.info('Swapped in the reloaded dataset')
+
+    def append(self, csv_text: str) -> int:
+        """
+        Appends rows to the dataset and swaps the result in, like a reload, with the
+        index updated incrementally instead of rebuilt. The rows are also appended to
+        the CSV file, so that the next load includes them.
+
+        Args:
+            csv_text (str): The rows, as CSV with a header line. Only the columns the
+                endpoints use are required; the others are left empty in the file.
+
+        Returns:
+            int: The number of rows appended, or None if the dataset is loading (or
+            could not be loaded), in which case nothing is appended.
+
+        Raises:
+            ValueError: If the rows cannot be parsed or lack a column the endpoints use.
+        """
+        # Imported here, so importing the package does not import pandas
+        import pandas as pd # pylint: disable=import-outside-toplevel
+
+        webserver = self.webserver
+        with self.lock:
+            data_ingestor = webserver.data_ingestor
+            if self.loading or data_ingestor is None:
+                return None
+
+            rows = pd.read_csv(io.StringIO(csv_text))
+            appended = data_ingestor.append_rows(rows)
+
+            header = pd.read_csv(self.csv_path, nrows=0).columns
+            with open(self.csv_path, 'rb') as f_in:
+                f_in.seek(-1, io.SEEK_END)
+                ends_with_newline = f_in.read(1) == b'\n'
+            with open(self.csv_path, 'a', encoding='utf-8', newline='') as f_out:
+                if not ends_with_newline:
+                    f_out.write('\n')
+                rows.reindex(columns=header).to_csv(f_out, header=False, index=False)
+            # The watcher must not reload the file for rows that are already in memory
+            self.mtime = stat(self.csv_path).st_mtime_ns
+
+            webserver.tasks_runner.set_data_ingestor(appended)
+            webserver.data_ingestor = appended
+            webserver.result_cache.clear()
+        webserver.logger.info('Appended %d rows to the dataset', len(rows))
+        return len(rows)
+
+    def watch(self, interval: float):
+        """
+        Starts a thread reloading the dataset whenever the modification time of the
+        CSV file changes.
+
+        Args:
+            interval (float): The number of seconds between two checks of the file.
+        """
+        def aux():
+            while True:
+                try:
+                    mtime = stat(self.csv_path).st_mtime_ns
+                except OSError:
+                    mtime = self.mtime
+                if self.mtime is None:
+                    self.mtime = mtime
+                elif mtime != self.mtime and self.load():
+                    self.mtime = mtime
+                time.sleep(interval)
+
+        Thread(target=aux, daemon=True).start()
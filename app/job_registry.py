@@ -0,0 +1,264 @@
+"""
+Module for the JobRegistry class, which keeps track of the jobs submitted to the server.
+"""
+from bisect import bisect_right
+from collections import deque
+from enum import Enum
+from itertools import count
+from threading import Event, Lock
+import time
+
+class JobState(Enum):
+    """
+    The states a job goes through: QUEUED -> RUNNING -> DONE or ERROR.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    ERROR = 'error'
+
+
+class Job: # pylint: disable=too-few-public-methods
+    """
+    A job submitted to the server.
+
+    Attributes:
+        job_id (int): The ID of the job.
+        endpoint (str): The name of the DataIngestor method computing the job.
+        state (JobState): The current state of the job.
+        submitted_at (float): When the job was submitted (time.monotonic()).
+        started_at (float): When a thread started computing the job, or None.
+        finished_at (float): When the job was done or failed, or None.
+        callbacks (list): Functions called once the job is done or failed.
+    """
+
+    def __init__(self, job_id: int, endpoint: str):
+        self.job_id = job_id
+        self.endpoint = endpoint
+        self.state = JobState.QUEUED
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.callbacks = []
+
+    @property
+    def status(self) -> str:
+        """
+        The status of the job as reported by the API: 'done', 'error' or 'running'.
+        """
+        if self.state in (JobState.DONE, JobState.ERROR):
+            return self.state.value
+        return 'running'
+
+
+class JobRegistry: # pylint: disable=too-many-instance-attributes
+    """
+    A thread-safe registry of the jobs submitted to the server.
+
+    Job IDs are allocated from an itertools.count, so concurrent requests always get
+    distinct IDs. The number of running and finished jobs is kept up to date on every
+    state change, so it can be read in constant time.
+
+    Only the max_done_jobs jobs that ended last are kept: older ones are evicted, along
+    with their result, so the registry of a long-running server does not grow forever.
+    Jobs that are queued or running are never evicted.
+
+    Attributes:
+        ids (count): The source of job IDs, starting at 1.
+        last_id (int): The last allocated job ID.
+        jobs (dict): job_id -> Job, in the order of the IDs.
+        job_ids (list): The IDs of the jobs kept, in increasing order, so they can be
+            bisected. Evicted IDs are only dropped from it once they outnumber the IDs
+            of the jobs kept.
+        running_jobs (int): The number of jobs queued or running.
+        done_jobs (int): The number of jobs done or failed since the server started.
+        metrics (Metrics): Records the latency of the jobs that end, or None.
+        max_done_jobs (int): The number of ended jobs kept, or 0 to keep them all.
+        ended (deque): The IDs of the ended jobs that are kept, in the order they ended.
+        result_store (ResultStore): Where the results of the jobs are saved, or None;
+            the result of an evicted job is deleted from it.
+        lock (Lock): Protects the jobs dictionary and the counters.
+
+    Methods:
+        create(endpoint: str) -> Job: Registers a new job.
+        get(job_id: int) -> Job: Returns a job, or None if the ID is unknown.
+        start(job_id: int): Marks a job as running.
+        finish(job_id: int): Marks a job as done.
+        fail(job_id: int): Marks a job as failed.
+        wait(job_id: int, timeout: float): Blocks until a job is done or failed.
+        add_done_callback(job_id: int, callback: function) -> bool: Calls a function once
+            a job is done or failed.
+        remove_done_callback(job_id: int, callback: function): Unregisters a function
+            registered by add_done_callback().
+        page(since: int, limit: int) -> list: Returns the jobs following a given ID.
+    """
+
+    def __init__(self, metrics=None, max_done_jobs: int = 0, result_store=None):
+        self.ids = count(1)
+        self.last_id = 0
+        self.jobs = {}
+        self.job_ids = []
+        self.running_jobs = 0
+        self.done_jobs = 0
+        self.metrics = metrics
+        self.max_done_jobs = max_done_jobs
+        self.ended = deque()
+        self.result_store = result_store
+        self.lock = Lock()
+
+    def create(self, endpoint: str) -> Job:
+        """
+        Registers a new job, in the QUEUED state.
+
+        Args:
+            endpoint (str): The name of the DataIngestor method computing the job.
+
+        Returns:
+            Job: The new job, with a fresh ID.
+        """
+        with self.lock:
+            job = Job(next(self.ids), endpoint)
+            self.jobs[job.job_id] = job
+            self.job_ids.append(job.job_id)
+            self.last_id = job.job_id
+            self.running_jobs += 1
+        return job
+
+    def get(self, job_id: int) -> Job:
+        """
+        Returns the job with the given ID.
+
+        Args:
+            job_id (int): The ID of the job.
+
+        Returns:
+            Job: The job, or None if there is no job with this ID.
+        """
+        return self.jobs.get(job_id)
+
+    def start(self, job_id: int):
+        """
+        Marks a job as picked up by a thread.
+
+        Args:
+            job_id (int): The ID of the job.
+        """
+        job = self.jobs[job_id]
+        job.started_at = time.monotonic()
+        job.state = JobState.RUNNING
+
+    def finish(self, job_id: int):
+        """
+        Marks a job as done, once its result is stored, and wakes up its waiters.
+
+        Args:
+            job_id (int): The ID of the job.
+        """
+        self._end(job_id, JobState.DONE)
+
+    def fail(self, job_id: int):
+        """
+        Marks a job as failed and wakes up its waiters.
+
+        Args:
+            job_id (int): The ID of the job.
+        """
+        self._end(job_id, JobState.ERROR)
+
+    def _end(self, job_id: int, state: JobState):
+        job = self.jobs[job_id]
+        job.finished_at = time.monotonic()
+        evicted = []
+        with self.lock:
+            job.state = state
+            self.running_jobs -= 1
+            self.done_jobs += 1
+            callbacks, job.callbacks = job.callbacks, []
+            self.ended.append(job_id)
+            while 0 < self.max_done_jobs < len(self.ended):
+                evicted.append(self.ended.popleft())
+                del self.jobs[evicted[-1]]
+            if len(self.job_ids) > 2 * len(self.jobs):
+                self.job_ids = list(self.jobs)
+        if self.result_store is not None:
+            for evicted_id in evicted:
+                self.result_store.delete(evicted_id)
+        if self.metrics is not None:
+            self.metrics.observe(job)
+        for callback in callbacks:
+            callback()
+
+    def wait(self, job_id: int, timeout: float):
+        """
+        Blocks until a job is done or failed, or the timeout expires.
+
+        Args:
+            job_id (int): The ID of the job.
+            timeout (float): The maximum number of seconds to wait.
+        """
+        finished = Event()
+        if self.add_done_callback(job_id, finished.set) and not finished.wait(timeout):
+            self.remove_done_callback(job_id, finished.set)
+
+    def add_done_callback(self, job_id: int, callback) -> bool:
+        """
+        Registers a function to be called, without arguments, by the thread that ends
+        a job. Unlike wait(), it lets an event loop wait for jobs without blocking a
+        thread per waiting client.
+
+        Args:
+            job_id (int): The ID of the job.
+            callback (function): The function.
+
+        Returns:
+            bool: False if the job is unknown or already ended, in which case the
+            function is not registered.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        with self.lock:
+            if job.status != 'running':
+                return False
+            job.callbacks.append(callback)
+        return True
+
+    def remove_done_callback(self, job_id: int, callback):
+        """
+        Unregisters a function registered by add_done_callback(), once its caller stopped
+        waiting for the job (e.g. on a timeout), so that waiters giving up on a job that
+        never ends do not pile up in it. Nothing is done if the job already ended.
+
+        Args:
+            job_id (int): The ID of the job.
+            callback (function): The function.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        with self.lock:
+            if callback in job.callbacks:
+                job.callbacks.remove(callback)
+
+    def page(self, since: int, limit: int) -> list:
+        """
+        Returns the jobs whose ID follows a given one. The IDs of the jobs kept are
+        bisected for the first one, and only the jobs returned are copied, so a page
+        does not depend on the number of jobs before it.
+
+        Args:
+            since (int): Only jobs with a greater ID are returned.
+            limit (int): The maximum number of jobs returned, or None for no limit.
+
+        Returns:
+            list: The jobs, ordered by ID.
+        """
+        jobs = []
+        with self.lock:
+            for position in range(bisect_right(self.job_ids, since), len(self.job_ids)):
+                if len(jobs) == limit:
+                    break
+                job = self.jobs.get(self.job_ids[position])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
@@ -0,0 +1,135 @@
+"""
+Module for the Metrics class, which collects the latency of the jobs and renders the
+server metrics in the Prometheus text format.
+"""
+from collections import defaultdict, deque
+from threading import Lock
+import math
+
+QUANTILES = [0.5, 0.95, 0.99]
+
+class Metrics:
+    """
+    Per-endpoint latency metrics of the jobs.
+
+    Every job that ends is split in its queue wait (from submission to the moment a
+    thread starts computing it) and its compute time. The quantiles are computed on the
+    latest `window` samples of each endpoint, while the sums and counts cover every job.
+    Jobs answered from the result cache are never started, so they only count in
+    webserver_jobs_total.
+
+    Attributes:
+        window (int): The number of latest samples the quantiles are computed on.
+        queue_times (defaultdict): endpoint -> deque of queue waits, in seconds.
+        compute_times (defaultdict): endpoint -> deque of compute times, in seconds.
+        sums (defaultdict): endpoint -> [total queue wait, total compute time, count].
+        jobs (defaultdict): (endpoint, status) -> number of jobs ended.
+        lock (Lock): Protects the samples and the counters.
+
+    Methods:
+        observe(job: Job): Records the latency of a job that ended.
+        render(gauges: list) -> str: Renders the metrics in the Prometheus text format.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.queue_times = defaultdict(lambda: deque(maxlen=self.window))
+        self.compute_times = defaultdict(lambda: deque(maxlen=self.window))
+        self.sums = defaultdict(lambda: [0.0, 0.0, 0])
+        self.jobs = defaultdict(int)
+        self.lock = Lock()
+
+    def observe(self, job):
+        """
+        Records the latency of a job that is done or failed.
+
+        Args:
+            job (Job): The job, with its submitted_at, started_at and finished_at times.
+        """
+        with self.lock:
+            self.jobs[(job.endpoint, job.status)] += 1
+            if job.started_at is None:
+                return
+            queue_time = job.started_at - job.submitted_at
+            compute_time = job.finished_at - job.started_at
+            self.queue_times[job.endpoint].append(queue_time)
+            self.compute_times[job.endpoint].append(compute_time)
+            sums = self.sums[job.endpoint]
+            sums[0] += queue_time
+            sums[1] += compute_time
+            sums[2] += 1
+
+    @staticmethod
+    def quantile(samples: list, quantile: float) -> float:
+        """
+        Returns a quantile of sorted samples, by the nearest-rank method.
+
+        Args:
+            samples (list): The samples, sorted.
+            quantile (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The smallest sample greater than or equal to a `quantile` fraction of
+            the samples.
+        """
+        return samples[max(0, math.ceil(quantile * len(samples)) - 1)]
+
+    @staticmethod
+    def summary(name: str, description: str, samples: dict, sums: dict) -> list:
+        """
+        Renders a latency summary in the Prometheus text format.
+
+        Args:
+            name (str): The name of the metric.
+            description (str): Its help text.
+            samples (dict): endpoint -> sorted latency samples.
+            sums (dict): endpoint -> (total latency, number of jobs).
+
+        Returns:
+            list: The lines of the summary.
+        """
+        lines = [f'# HELP {name} {description}', f'# TYPE {name} summary']
+        for endpoint, times in sorted(samples.items()):
+            for quantile in QUANTILES:
+                lines.append(f'{name}{{endpoint="{endpoint}",quantile="{quantile}"}} '
+                             f'{Metrics.quantile(times, quantile)}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {sums[endpoint][0]}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {sums[endpoint][1]}')
+        return lines
+
+    def render(self, gauges: list) -> str:
+        """
+        Renders the latency summaries, the job counters and the given gauges in the
+        Prometheus text format.
+
+        Args:
+            gauges (list): (name, type, help, value) tuples of the other server metrics.
+
+        Returns:
+            str: The metrics.
+        """
+        with self.lock:
+            samples = {'queue': {endpoint: sorted(times)
+                                 for endpoint, times in self.queue_times.items()},
+                       'compute': {endpoint: sorted(times)
+                                   for endpoint, times in self.compute_times.items()}}
+            sums = {endpoint: list(endpoint_sums) for endpoint, endpoint_sums in self.sums.items()}
+            jobs = dict(self.jobs)
+
+        lines = self.summary('webserver_job_queue_seconds', 'Time jobs waited in the job queue.',
+                             samples['queue'], {endpoint: (endpoint_sums[0], endpoint_sums[2])
+                                                for endpoint, endpoint_sums in sums.items()})
+        lines += self.summary('webserver_job_compute_seconds', 'Time spent computing jobs.',
+                              samples['compute'], {endpoint: (endpoint_sums[1], endpoint_sums[2])
+                                                   for endpoint, endpoint_sums in sums.items()})
+
+        lines += ['# HELP webserver_jobs_total Jobs done or failed.',
+                  '# TYPE webserver_jobs_total counter']
+        for (endpoint, status), count in sorted(jobs.items()):
+            lines.append(f'webserver_jobs_total{{endpoint="{endpoint}",status="{status}"}} '
+                         f'{count}')
+
+        for name, metric_type, description, value in gauges:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}',
+                      f'{name} {value}']
+        return '\n'.join(lines) + '\n'
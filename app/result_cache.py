@@ -0,0 +1,110 @@
+"""
+Module for the ResultCache class.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+class ResultCache:
+    """
+    A bounded, thread-safe cache of DataIngestor results with LRU eviction.
+
+    Results are keyed on the endpoint name and its arguments, e.g.
+    ('state_mean', question, state), so repeated requests can be answered without
+    recomputing them. Results are cached as encoded JSON bytes, so a cache hit is
+    recorded in the result store without being encoded or copied again.
+
+    Attributes:
+        max_size (int): The maximum number of cached results; 0 disables the cache.
+        entries (OrderedDict): The cached results, from least to most recently used.
+        lock (Lock): Protects the entries and the counters.
+        hits (int): The number of lookups that found a result.
+        misses (int): The number of lookups that did not find a result.
+        generation (int): Incremented on every clear(), so results computed before
+            the cache was invalidated are not stored afterwards.
+
+    Methods:
+        get(key: tuple) -> bytes: Returns the cached result for a key, or None.
+        put(key: tuple, result: bytes, generation: int): Caches a result.
+        wrap(key: tuple, job: function, generation: int) -> function: Wraps a job so that
+            it caches its result.
+        clear(): Drops every cached result.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+
+    def get(self, key: tuple) -> bytes:
+        """
+        Returns the cached result for a key and marks it as the most recently used.
+
+        Args:
+            key (tuple): The endpoint name followed by its arguments.
+
+        Returns:
+            bytes: The cached result, or None if the key is not cached.
+        """
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key: tuple, result: bytes, generation: int):
+        """
+        Caches a result, evicting the least recently used ones if the cache is full.
+
+        Args:
+            key (tuple): The endpoint name followed by its arguments.
+            result (bytes): The JSON result of the job.
+            generation (int): The cache generation the result was computed in; the
+                result is dropped if the cache has been cleared since.
+        """
+        with self.lock:
+            if generation != self.generation or self.max_size <= 0:
+                return
+
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def wrap(self, key: tuple, job, generation: int = None):
+        """
+        Wraps a job so that its result is encoded and cached once it has been computed.
+
+        Args:
+            key (tuple): The endpoint name followed by its arguments.
+            job (function): The closure returned by a DataIngestor method.
+            generation (int): The cache generation read before the dataset the job is
+                computed on, or None for the current one.
+
+        Returns:
+            function: A closure that runs the job, caches and returns its result as
+            UTF-8 bytes.
+        """
+        if generation is None:
+            generation = self.generation
+
+        def aux():
+            result = job().encode('utf-8')
+            self.put(key, result, generation)
+            return result
+
+        return aux
+
+    def clear(self):
+        """
+        Drops every cached result. Must be called whenever the dataset is reloaded.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
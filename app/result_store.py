@@ -0,0 +1,171 @@
+"""
+Module for the result stores, where the TaskRunner threads save the results of the jobs.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from os import path, makedirs, replace, remove, fstat
+import time
+
+# Size of the chunks a result file is streamed in, in bytes
+CHUNK_SIZE = 64 * 1024
+
+class ResultStore(ABC):
+    """
+    The interface of a job result store.
+
+    Results are kept as already-serialized JSON bytes, so they can be sent to the
+    client without being parsed and encoded again.
+
+    Methods:
+        put(job_id: int, result: bytes): Saves the result of a job.
+        get(job_id: int) -> bytes: Returns the result of a job, or None if there is none.
+        stream(job_id: int) -> tuple: Returns the length and the chunks of the result
+            of a job, or None if there is none.
+        delete(job_id: int): Deletes the result of a job, if there is one.
+    """
+
+    @abstractmethod
+    def put(self, job_id: int, result: bytes):
+        """
+        Saves the result of a job.
+
+        Args:
+            job_id (int): The ID of the job.
+            result (bytes): The JSON result of the job.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, job_id: int) -> bytes:
+        """
+        Returns the result of a job.
+
+        Args:
+            job_id (int): The ID of the job.
+
+        Returns:
+            bytes: The JSON result of the job, or None if it is not available.
+        """
+        raise NotImplementedError
+
+    def stream(self, job_id: int) -> tuple:
+        """
+        Returns the result of a job as chunks, so it can be sent to the client as it is
+        read instead of being copied into a single response body.
+
+        Args:
+            job_id (int): The ID of the job.
+
+        Returns:
+            tuple: The length of the JSON result in bytes and an iterable of its chunks,
+            or None if it is not available.
+        """
+        result = self.get(job_id)
+        if result is None:
+            return None
+        return len(result), [result]
+
+    @abstractmethod
+    def delete(self, job_id: int):
+        """
+        Deletes the result of a job, once the job is forgotten.
+
+        Args:
+            job_id (int): The ID of the job.
+        """
+        raise NotImplementedError
+
+
+class MemoryResultStore(ResultStore):
+    """
+    A result store that keeps the results in memory.
+
+    Results are dropped once they are older than the TTL, and the oldest ones are
+    dropped when there are more than max_size of them.
+
+    Attributes:
+        ttl (float): The number of seconds a result is kept.
+        max_size (int): The maximum number of results kept.
+        results (OrderedDict): job_id -> (expiry time, result), oldest first.
+        lock (Lock): Protects the results.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.lock = Lock()
+
+    def put(self, job_id: int, result: bytes):
+        now = time.monotonic()
+        with self.lock:
+            self.results[job_id] = (now + self.ttl, result)
+            while self.results:
+                oldest_expiry, _ = next(iter(self.results.values()))
+                if oldest_expiry > now and len(self.results) <= self.max_size:
+                    break
+                self.results.popitem(last=False)
+
+    def get(self, job_id: int) -> bytes:
+        with self.lock:
+            entry = self.results.get(job_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def delete(self, job_id: int):
+        with self.lock:
+            self.results.pop(job_id, None)
+
+
+class FileResultStore(ResultStore):
+    """
+    A result store that keeps every result in a '<directory>/<job_id>' file.
+
+    Results are written to a temporary file which is then renamed, so a reader never
+    sees a partially written result. Streamed results are read CHUNK_SIZE bytes at a
+    time, so a large result is never held in memory as a whole.
+
+    Attributes:
+        directory (str): The directory holding the result files.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        if not path.exists(directory):
+            makedirs(directory)
+
+    def put(self, job_id: int, result: bytes):
+        file_path = path.join(self.directory, str(job_id))
+        with open(f'{file_path}.tmp', 'wb') as f_out:
+            f_out.write(result)
+        replace(f'{file_path}.tmp', file_path)
+
+    def get(self, job_id: int) -> bytes:
+        try:
+            with open(path.join(self.directory, str(job_id)), 'rb') as f_in:
+                return f_in.read()
+        except FileNotFoundError:
+            return None
+
+    def stream(self, job_id: int) -> tuple:
+        file_path = path.join(self.directory, str(job_id))
+        try:
+            # Closed by the generator, once the response has been sent
+            f_in = open(file_path, 'rb') # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            return None
+
+        def chunks():
+            with f_in:
+                while chunk := f_in.read(CHUNK_SIZE):
+                    yield chunk
+
+        return fstat(f_in.fileno()).st_size, chunks()
+
+    def delete(self, job_id: int):
+        try:
+            remove(path.join(self.directory, str(job_id)))
+        except FileNotFoundError:
+            pass
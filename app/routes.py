@@ -1,13 +1,22 @@
 """
-This module contains the API endpoints for the webserver.
+This module contains the API endpoints for the webserver, registered by create_app()
+through the api blueprint.
 """
-import json
+from queue import Full
+import random
 
-from flask import request, jsonify
-from app import webserver
+from flask import Blueprint, current_app, request, jsonify
+
+api = Blueprint('api', __name__)
+
+# Upper bound of the '?wait=' long-polling timeout of get_results, in seconds
+MAX_RESULT_WAIT = 30
+
+# Seconds after which a client rejected because the job queue is full should retry
+RETRY_AFTER = 1
 
 # Example endpoint definition
-@webserver.route('/api/post_endpoint', methods=['POST'])
+@api.route('/api/post_endpoint', methods=['POST'])
 def post_endpoint():
     """
     Handle the POST request and process the received data.
@@ -30,11 +39,145 @@ def post_endpoint():
         return jsonify(response)
     return jsonify({"error": "Method not allowed"}), 405
 
-@webserver.route('/api/get_results/<job_id>', methods=['GET'])
+def submit_job(endpoint: str, *args, inline: bool = False, priority: int = 0) -> tuple:
+    """
+    Assigns a job ID to a DataIngestor request and schedules it.
+
+    Results are cached on the endpoint name and its arguments; a cached result is
+    recorded right away, so the job is done as soon as it is submitted. Otherwise the
+    job is put in the tasks runner queue and its result is cached once computed.
+    Inline jobs whose estimated cost is below the server's threshold are computed
+    on the spot instead of being queued, once the dataset is loaded; if the computation
+    raises, the job is marked as failed.
+
+    Args:
+        endpoint (str): The name of the DataIngestor method, e.g. 'state_mean'.
+        *args: The arguments of the method, e.g. the question and the state.
+        inline (bool): Whether the job may be computed by the calling thread.
+        priority (int): The priority of the job in the queue, 0 being the most urgent.
+
+    Returns:
+        tuple: The ID of the job and, for jobs that are already done (answered from the
+        cache or computed inline), their JSON result as bytes (None otherwise).
+
+    Raises:
+        Full: If the job queue is full, in which case no job ID is allocated.
+    """
+    key = (endpoint,) + args
+    result = current_app.result_cache.get(key)
+    # Read before the dataset: if a reload swaps it and clears the cache in between, the
+    # result computed on the old dataset is then not cached
+    generation = current_app.result_cache.generation
+    data_ingestor = current_app.data_ingestor
+    if result is None and not (
+            inline and data_ingestor is not None
+            and data_ingestor.estimate_cost(endpoint, *args) <= current_app.sync_cost_threshold):
+        job = current_app.result_cache.wrap(key, current_app.tasks_runner.job(endpoint, *args),
+                                            generation)
+        return current_app.tasks_runner.submit(endpoint, job, priority), None
+
+    job_id = current_app.job_registry.create(endpoint).job_id
+    if result is None:
+        current_app.job_registry.start(job_id)
+        try:
+            result = current_app.result_cache.wrap(key, getattr(data_ingestor, endpoint)(*args),
+                                                   generation)()
+        except Exception: # pylint: disable=broad-exception-caught
+            # Reported as failed, like the queued jobs that raise
+            current_app.logger.exception('Job %d failed', job_id)
+            current_app.job_registry.fail(job_id)
+
+    if result is not None:
+        current_app.tasks_runner.complete(job_id, result)
+
+    return job_id, result
+
+def result_response(prefix: bytes, length: int, chunks):
+    """
+    Builds the response of a job that is done. Its result is already JSON, so it is
+    embedded as is instead of being parsed and encoded again, and its chunks are
+    streamed after the prefix instead of being copied into a single body.
+
+    Args:
+        prefix (bytes): The start of the JSON response, up to the "data" key.
+        length (int): The length of the result in bytes.
+        chunks (iterable): The chunks of the result.
+
+    Returns:
+        A streamed JSON response, with its Content-Length set.
+    """
+    def body():
+        yield prefix
+        yield from chunks
+        yield b'}'
+
+    return current_app.response_class(body(), mimetype='application/json',
+                                      headers={'Content-Length': len(prefix) + length + 1})
+
+def job_response(endpoint: str, *args):
+    """
+    Submits a DataIngestor request and builds the response of its route.
+
+    The request is computed inline if its body has "sync": true, or if the server
+    runs with SYNC_FAST_PATH=1 and the body does not have "sync": false. Jobs that
+    are done once submitted, i.e. computed inline or answered from the result cache,
+    answer with their data right away, alongside the job ID, so the client does not
+    have to poll for it.
+
+    Queued jobs are scheduled by the "priority" of the body (a non-negative integer,
+    0 being the most urgent), or by the cost class of the request by default, so
+    cheap requests go before expensive ones.
+
+    Args:
+        endpoint (str): The name of the DataIngestor method, e.g. 'state_mean'.
+        *args: The arguments of the method, e.g. the question and the state.
+
+    Returns:
+        A JSON response containing the status and the job ID, and the data if done (or
+        an error if the job was computed inline and failed), or a 429 response with a
+        Retry-After header if the job queue is full.
+    """
+    # Imported here, so importing the routes does not import pandas
+    from app.data_ingestor import DataIngestor # pylint: disable=import-outside-toplevel
+
+    priority = request.json.get('priority')
+    if priority is None:
+        priority = DataIngestor.cost_class(endpoint, *args)
+    elif not isinstance(priority, int) or priority < 0:
+        return jsonify({"status": "error", "reason": "Invalid priority"})
+
+    try:
+        job_id, result = submit_job(endpoint, *args,
+                                    inline=request.json.get('sync', current_app.sync_fast_path),
+                                    priority=priority)
+    except Full:
+        current_app.logger.error('%s %s - job queue full', request.method, request.url)
+        return jsonify({"status": "error",
+                        "reason": "Too many jobs queued"}), 429, {'Retry-After': RETRY_AFTER}
+
+    if result is None:
+        if current_app.job_registry.get(job_id).status == 'error':
+            return jsonify({"status": "error", "job_id": job_id, "reason": "Job failed"})
+        return jsonify({
+            'status': 'running',
+            'job_id': job_id
+        })
+
+    return result_response(b'{"status": "done", "job_id": %d, "data": ' % job_id,
+                           len(result), [result])
+
+@api.route('/api/get_results/<job_id>', methods=['GET'])
 def get_response(job_id):
     """
     Get the response for a given job ID.
 
+    With the '?wait=<seconds>' query parameter, a request for a job that is still
+    running blocks until the job is done or the timeout expires, instead of
+    returning right away.
+
+    Clients poll this route, so only a LOG_POLL_SAMPLE_RATE fraction of the requests
+    is logged (all of them by default).
+
     Args:
         job_id (int): The ID of the job.
 
@@ -45,29 +188,35 @@ def get_response(job_id):
         None
 
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s', request.method, request.url)
+    if random.random() < current_app.poll_log_rate:
+        current_app.logger.info('%s %s', request.method, request.url)
 
-    if int(job_id) > webserver.job_counter:
+    job = current_app.job_registry.get(int(job_id))
+    if job is None:
         return jsonify({"status": "error",
                         "reason" : "Invalid job_id"})
 
-    try:
-        with open(f'./results/{job_id}', 'r', encoding='utf-8') as f_in:
+    result = current_app.result_store.stream(job.job_id)
+    wait = request.args.get('wait', type=float)
+    if result is None and wait:
+        current_app.job_registry.wait(job.job_id, min(wait, MAX_RESULT_WAIT))
+        result = current_app.result_store.stream(job.job_id)
 
+    if result is None:
+        if job.status == 'running':
             return jsonify({
-                'status': 'done',
-                'data': json.load(f_in)
+                'status': 'running'
             })
-    except Exception:
-        return jsonify({
-            'status': 'running'
-        })
+        return jsonify({"status": "error",
+                        "reason": "Job failed" if job.status == 'error' else "Result expired"})
+
+    return result_response(b'{"status": "done", "data": ', *result)
 
-@webserver.route('/api/states_mean', methods=['POST'])
+@api.route('/api/states_mean', methods=['POST'])
 def states_mean_request():
     """
     Handle the request for calculating the mean of states.
@@ -75,24 +224,17 @@ def states_mean_request():
     Returns:
         A JSON response containing the status of the request and the job ID.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                                      webserver.data_ingestor.states_mean(data['question'])))
-    webserver.job_counter += 1
+    return job_response('states_mean', data['question'])
 
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
-
-@webserver.route('/api/state_mean', methods=['POST'])
+@api.route('/api/state_mean', methods=['POST'])
 def state_mean_request():
     """
     Handles the state mean request.
@@ -107,24 +249,18 @@ def state_mean_request():
     Raises:
         None
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                        webserver.data_ingestor.state_mean(data['question'], data['state'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('state_mean', data['question'], data['state'])
 
 
-@webserver.route('/api/best5', methods=['POST'])
+@api.route('/api/best5', methods=['POST'])
 def best5_request():
     """
     Handles the request for the best5 endpoint.
@@ -132,23 +268,17 @@ def best5_request():
     Returns:
         A JSON response containing the status of the request and the job ID.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                                    webserver.data_ingestor.best5(data['question'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('best5', data['question'])
 
-@webserver.route('/api/worst5', methods=['POST'])
+@api.route('/api/worst5', methods=['POST'])
 def worst5_request():
     """
     Handles the worst5_request API endpoint.
@@ -157,28 +287,22 @@ def worst5_request():
     It checks if the server is down and returns an error message if it is.
     It logs the request details and the received JSON data.
     It puts the task in the tasks_runner queue to calculate the worst 5 sports based on the
-    given question. It increments the job_counter and returns the status and job_id of the task.
+    given question. It allocates a job ID and returns the status and job_id of the task.
 
     Returns:
         A JSON response containing the status and job_id of the task.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                                    webserver.data_ingestor.worst5(data['question'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('worst5', data['question'])
 
-@webserver.route('/api/global_mean', methods=['POST'])
+@api.route('/api/global_mean', methods=['POST'])
 def global_mean_request():
     """
     Handle the request for calculating the global mean.
@@ -186,23 +310,17 @@ def global_mean_request():
     Returns:
         A JSON response containing the status of the request and the job ID.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                                    webserver.data_ingestor.global_mean(data['question'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('global_mean', data['question'])
 
-@webserver.route('/api/diff_from_mean', methods=['POST'])
+@api.route('/api/diff_from_mean', methods=['POST'])
 def diff_from_mean_request():
     """
     Handle the request to calculate the difference from the mean.
@@ -210,22 +328,16 @@ def diff_from_mean_request():
     Returns:
         A JSON response containing the status of the job and the job ID.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                                    webserver.data_ingestor.diff_from_mean(data['question'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('diff_from_mean', data['question'])
 
-@webserver.route('/api/state_diff_from_mean', methods=['POST'])
+@api.route('/api/state_diff_from_mean', methods=['POST'])
 def state_diff_from_mean_request():
     """
     Handles the state_diff_from_mean request.
@@ -240,23 +352,17 @@ def state_diff_from_mean_request():
     Raises:
         None
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                    webserver.data_ingestor.state_diff_from_mean(data['question'], data['state'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('state_diff_from_mean', data['question'], data['state'])
 
-@webserver.route('/api/mean_by_category', methods=['POST'])
+@api.route('/api/mean_by_category', methods=['POST'])
 def mean_by_category_request():
     """
     Handle the request to calculate the mean by category.
@@ -264,23 +370,17 @@ def mean_by_category_request():
     Returns:
         A JSON response containing the status of the request and the job ID.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                                    webserver.data_ingestor.mean_by_category(data['question'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('mean_by_category', data['question'])
 
-@webserver.route('/api/state_mean_by_category', methods=['POST'])
+@api.route('/api/state_mean_by_category', methods=['POST'])
 def state_mean_by_category_request():
     """
     Handles the request to calculate the mean by category for a given state.
@@ -288,23 +388,76 @@ def state_mean_by_category_request():
     Returns:
         A JSON response containing the status of the request and the job ID.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s %s', request.method, request.url, request.json)
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
 
     data = request.json
 
-    webserver.tasks_runner.queue.put((webserver.job_counter,
-                webserver.data_ingestor.state_mean_by_category(data['question'], data['state'])))
-    webserver.job_counter += 1
-    return jsonify({
-        'status': 'running',
-        'job_id': webserver.job_counter - 1
-    })
+    return job_response('state_mean_by_category', data['question'], data['state'])
+
+@api.route('/api/batch', methods=['POST'])
+def batch_request():
+    """
+    Handles a batch of requests, scheduled as a single job.
+
+    The body holds a list of queries, e.g.
+    {"queries": [{"endpoint": "best5", "question": "..."},
+                 {"endpoint": "state_mean", "question": "...", "state": "Utah"}]}
+    and the result of the job is the list of their results, in the same order.
+
+    Returns:
+        A JSON response containing the status of the request and the job ID, or an
+        error, without creating a job, if a query is invalid.
+    """
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
+        return jsonify({"status": "server down"})
+
+    current_app.logger.info('%s %s %s', request.method, request.url, request.json)
+
+    queries = request.json.get('queries')
+    if not isinstance(queries, list):
+        return jsonify({"status": "error", "reason": "Invalid queries"})
+    try:
+        queries = [batch_query(query) for query in queries]
+    except ValueError as error:
+        return jsonify({"status": "error", "reason": str(error)})
+
+    return job_response('batch', *queries)
+
+def batch_query(query: dict) -> tuple:
+    """
+    Checks a query of a batch and returns its descriptor, so that invalid queries are
+    rejected before a job is created for the batch.
+
+    Args:
+        query (dict): The query, with its "endpoint", its "question" and, for the
+            endpoints of a single state, its "state".
+
+    Returns:
+        tuple: (endpoint, question) or (endpoint, question, state).
+
+    Raises:
+        ValueError: If the endpoint is unknown, or the query does not have exactly the
+            string arguments of its endpoint.
+    """
+    # Imported here, so importing the routes does not import pandas
+    from app.data_ingestor import REDUCTION_WEIGHTS, STATE_ENDPOINTS # pylint: disable=import-outside-toplevel
 
-@webserver.route('/api/graceful_shutdown', methods=['GET'])
+    endpoint = query.get('endpoint') if isinstance(query, dict) else None
+    if endpoint not in REDUCTION_WEIGHTS:
+        raise ValueError(f"Invalid endpoint {endpoint}")
+
+    names = ['question', 'state'] if endpoint in STATE_ENDPOINTS else ['question']
+    if set(query) != {'endpoint', *names} \
+            or not all(isinstance(query[name], str) for name in names):
+        raise ValueError(f"Invalid query for {endpoint}: expected {' and '.join(names)}")
+    return (endpoint, *(query[name] for name in names))
+
+@api.route('/api/graceful_shutdown', methods=['GET'])
 def graceful_shutdown():
     """
     Gracefully shuts down the server.
@@ -316,37 +469,41 @@ def graceful_shutdown():
     Returns:
         A JSON response indicating the status of the server shutdown.
     """
-    webserver.logger.info('%s %s', request.method, request.url)
+    current_app.logger.info('%s %s', request.method, request.url)
 
-    webserver.shutdown = True
-    webserver.tasks_runner.shutdown()
+    current_app.shutdown = True
+    current_app.tasks_runner.shutdown()
     return jsonify({"status" : "shutting down server"})
 
 
-@webserver.route('/api/jobs', methods=['GET'])
+@api.route('/api/jobs', methods=['GET'])
 def jobs():
     """
     Returns the status of the jobs running on the server.
 
+    The '?since=<job_id>&limit=<count>' query parameters return at most 'limit' jobs,
+    starting after the job 'since'; without them, every job is returned.
+
     Returns:
         A JSON response containing the status of the jobs.
     """
-    if webserver.shutdown:
-        webserver.logger.error('%s %s - server down', request.method, request.url)
+    if current_app.shutdown:
+        current_app.logger.error('%s %s - server down', request.method, request.url)
         return jsonify({"status": "server down"})
 
-    webserver.logger.info('%s %s',request.method, request.url)
+    current_app.logger.info('%s %s',request.method, request.url)
 
     return jsonify({
         'status': 'done',
-        'data' : [{str(i) : "done" if i in webserver.tasks_runner.tasks else "running"}
-                for i in range(1, webserver.job_counter)]
+        'data' : [{str(job.job_id) : job.status}
+                  for job in current_app.job_registry.page(
+                      request.args.get('since', 0, type=int), request.args.get('limit', type=int))]
     })
 
 
 # You can check localhost in your browser to see what this displays
-@webserver.route('/')
-@webserver.route('/index')
+@api.route('/')
+@api.route('/index')
 def index():
     """
     Returns a message containing the defined routes of the webserver.
@@ -374,12 +531,131 @@ def get_defined_routes():
         along with the HTTP methods allowed for each route.
     """
     routes = []
-    for rule in webserver.url_map.iter_rules():
+    for rule in current_app.url_map.iter_rules():
         methods = ', '.join(rule.methods)
         routes.append(f"Endpoint: \"{rule}\" Methods: \"{methods}\"")
     return routes
 
-@webserver.route('/api/num_jobs', methods=['GET'])
+@api.route('/api/ready', methods=['GET'])
+def ready():
+    """
+    Tells whether the dataset is loaded. Jobs submitted before it is wait in the
+    job queue.
+
+    Returns:
+        A JSON response with the status "ready", or "loading" (503) while the dataset
+        is being loaded, or "error" (503) if it could not be loaded.
+    """
+    if current_app.data_ingestor is not None:
+        return jsonify({"status": "ready"})
+    if current_app.dataset_loader.loading:
+        return jsonify({"status": "loading"}), 503, {'Retry-After': RETRY_AFTER}
+    return jsonify({"status": "error", "reason": "Could not load the dataset"}), 503
+
+def admin_forbidden():
+    """
+    Checks the X-Admin-Token header of an admin request. The admin routes are disabled
+    unless the server runs with ADMIN_TOKEN set.
+
+    Returns:
+        A 403 JSON response if ADMIN_TOKEN is not set or the token is wrong, None
+        otherwise.
+    """
+    if not current_app.admin_token \
+            or request.headers.get('X-Admin-Token') != current_app.admin_token:
+        current_app.logger.error('%s %s - forbidden', request.method, request.url)
+        return jsonify({"status": "error", "reason": "Forbidden"}), 403
+    return None
+
+@api.route('/api/admin/reload', methods=['POST'])
+def reload_dataset():
+    """
+    Reloads the dataset from the CSV file in the background. The current dataset keeps
+    answering requests until the new one, with its index, is ready to be swapped in.
+
+    The request must carry the ADMIN_TOKEN of the server in the X-Admin-Token header.
+
+    Returns:
+        A JSON response with the status "reloading", or an error if a load is already
+        running (409) or the token is wrong or not set (403).
+    """
+    forbidden = admin_forbidden()
+    if forbidden is not None:
+        return forbidden
+
+    current_app.logger.info('%s %s', request.method, request.url)
+
+    if not current_app.dataset_loader.load():
+        return jsonify({"status": "error", "reason": "The dataset is already loading"}), 409
+    return jsonify({"status": "reloading"})
+
+@api.route('/api/admin/append', methods=['POST'])
+def append_rows():
+    """
+    Appends the CSV rows in the request body (with a header line) to the dataset and to
+    the CSV file. The sums and counts of the index are updated with the new rows only,
+    so the dataset is not parsed again, and the result cache is cleared.
+
+    The request must carry the ADMIN_TOKEN of the server in the X-Admin-Token header.
+
+    Returns:
+        A JSON response with the status "done" and the number of rows appended, or an
+        error if the rows are invalid (400), the dataset is loading (409) or the token
+        is wrong or not set (403).
+    """
+    forbidden = admin_forbidden()
+    if forbidden is not None:
+        return forbidden
+
+    current_app.logger.info('%s %s', request.method, request.url)
+
+    try:
+        rows = current_app.dataset_loader.append(request.get_data(as_text=True))
+    except ValueError as error:
+        current_app.logger.error('%s %s - invalid rows: %s', request.method, request.url,
+                                 error)
+        return jsonify({"status": "error", "reason": f"Invalid rows: {error}"}), 400
+    if rows is None:
+        return jsonify({"status": "error", "reason": "The dataset is loading"}), 409
+    return jsonify({"status": "done", "rows": rows})
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Returns the metrics of the server in the Prometheus text format: the queue wait and
+    compute time quantiles of every endpoint, the number of jobs, the queue depth, the
+    utilization of the worker threads and the result cache hit rate.
+
+    Returns:
+        A text/plain response containing the metrics.
+    """
+    tasks_runner = current_app.tasks_runner
+    cache = current_app.result_cache
+    busy_threads = sum(thread.busy for thread in tasks_runner.threads)
+    lookups = cache.hits + cache.misses
+
+    gauges = [
+        ('webserver_queue_depth', 'gauge', 'Jobs waiting in the job queue.',
+         tasks_runner.queue.qsize()),
+        ('webserver_running_jobs', 'gauge', 'Jobs queued or running.',
+         current_app.job_registry.running_jobs),
+        ('webserver_rejected_jobs_total', 'counter', 'Jobs rejected because the queue was full.',
+         tasks_runner.rejected_jobs),
+        ('webserver_worker_utilization', 'gauge', 'Fraction of the worker threads computing a job.',
+         busy_threads / tasks_runner.num_threads),
+        ('webserver_worker_busy_seconds_total', 'counter',
+         'Time the worker threads spent computing jobs.',
+         sum(thread.busy_time for thread in tasks_runner.threads)),
+        ('webserver_result_cache_hits_total', 'counter', 'Result cache hits.', cache.hits),
+        ('webserver_result_cache_misses_total', 'counter', 'Result cache misses.', cache.misses),
+        ('webserver_result_cache_hit_ratio', 'gauge',
+         'Fraction of the result cache lookups that hit.',
+         cache.hits / lookups if lookups else 0),
+    ]
+    return current_app.response_class(current_app.metrics.render(gauges),
+                                      mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/num_jobs', methods=['GET'])
 def num_jobs():
     """
     Returns the number of jobs currently running.
@@ -387,4 +663,4 @@ def num_jobs():
     Returns:
         A JSON response containing the number of jobs.
     """
-    return jsonify({"num_jobs": webserver.job_counter - len(webserver.tasks_runner.tasks) - 1})
+    return jsonify({"num_jobs": current_app.job_registry.running_jobs})
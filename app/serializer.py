@@ -0,0 +1,147 @@
+"""
+Module for the JSON serializer of the job results and of the responses, which uses
+orjson when it is installed and the json module otherwise (or with JSON_SERIALIZER=json).
+
+Results keep the keys and values they had when pandas wrote them: series_json() writes
+a Series with the labels of Series.to_json(), values rounded to DOUBLE_PRECISION
+decimals, NaN written as null and '/' escaped. Only the notation of the numbers of the
+large series it writes itself may differ from pandas (e.g. 2.3643e-06 for 0.0000023643).
+"""
+from os import environ
+import json
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None and environ.get('JSON_SERIALIZER') != 'json' \
+    else 'json'
+
+# Decimals kept by Series.to_json(), whose format the results keep
+DOUBLE_PRECISION = 10
+
+# Below this number of rows, or with a single-level index, Series.to_json() is faster
+SERIES_JSON_MIN_ROWS = 128
+
+def dumps(obj, sort_keys: bool = False, default=None) -> bytes:
+    """
+    Serializes an object to compact JSON.
+
+    Args:
+        obj: The object, made of dicts, lists, strings, numbers, booleans and None.
+        sort_keys (bool): Whether the keys of the dicts are sorted.
+        default (function): Called on the values that cannot be serialized otherwise,
+            returning a serializable value or raising TypeError.
+
+    Returns:
+        bytes: The UTF-8 encoded JSON.
+    """
+    # pylint: disable=no-member
+    if BACKEND == 'orjson':
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, sort_keys=sort_keys, default=default,
+                      separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    """
+    Parses JSON.
+
+    Args:
+        data (str or bytes): The JSON.
+
+    Returns:
+        The parsed object.
+    """
+    # pylint: disable=no-member
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+def series_dict(series) -> dict:
+    """
+    Builds the dict of a pandas Series straight from its numpy arrays, with the keys
+    and values Series.to_json() writes: the tuple labels of a MultiIndex become
+    str(tuple), the values are rounded to DOUBLE_PRECISION decimals and NaN becomes None.
+    The rounding is numpy's, so a value may differ from the one parsed back from
+    Series.to_json() in its last digit.
+
+    Args:
+        series (pd.Series): The series.
+
+    Returns:
+        dict: label -> value, in the order of the series.
+    """
+    values = np.round(series.to_numpy(dtype='float64', na_value=np.nan), DOUBLE_PRECISION)
+    # Adding 0.0 turns -0.0 into 0.0, as Series.to_json() writes it
+    values = values + 0.0
+    nans = np.isnan(values)
+    if nans.any():
+        values = np.where(nans, None, values)
+    return dict(zip(index_keys(series.index), values.tolist()))
+
+def index_keys(index) -> list:
+    """
+    Returns the labels of an index as strings. The str(tuple) of every label of a
+    MultiIndex is built by concatenating the reprs of the distinct labels of each level,
+    so repr() is only called once per distinct label.
+
+    Args:
+        index (pd.Index): The index.
+
+    Returns:
+        list: The labels, as strings.
+    """
+    if index.nlevels == 1:
+        return index.astype(str).tolist()
+    keys = None
+    for level, codes in zip(index.levels, index.codes):
+        # Code -1 stands for a missing label, which str(tuple) writes as nan
+        reprs = np.array([repr(label) for label in level.tolist()] + ['nan'],
+                         dtype=object)[codes]
+        keys = reprs if keys is None else keys + ', ' + reprs
+    return ('(' + keys + ')').tolist()
+
+def series_json(series) -> str:
+    """
+    Writes a pandas Series as a JSON object, like Series.to_json().
+
+    Small series, and series with a single-level index, are written by Series.to_json()
+    itself. Larger series with a MultiIndex are written from series_dict() by dumps(),
+    which is faster than pandas building the str(tuple) of every label: the keys are
+    the same, but the numbers may be written in another notation, or differ in their
+    last digit.
+
+    Args:
+        series (pd.Series): The series.
+
+    Returns:
+        str: The JSON object of the series.
+    """
+    if series.index.nlevels == 1 or len(series) < SERIES_JSON_MIN_ROWS:
+        return series.to_json()
+    result = dumps(series_dict(series))
+    if not result.isascii():
+        # Like pandas, write the non-ASCII characters as \u escapes
+        result = json.dumps(json.loads(result), separators=(',', ':')).encode('ascii')
+    return result.replace(b'/', b'\\/').decode('ascii')
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    The Flask JSON provider of the webserver: jsonify() and request.json go through
+    the serializer above, except for the indented output of debug mode.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        if 'indent' in kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
@@ -0,0 +1,221 @@
+"""
+Module for sharing the dataset between processes through a shared memory segment.
+
+One process publishes the columns of the dataset (numeric columns as they are, string
+columns as categorical codes plus their table of distinct values) into a named segment;
+the other processes attach to it and build their DataFrame directly on top of the
+shared buffers, without parsing the CSV or copying the data.
+
+Segment layout:
+    byte 0          ready flag, set to 1 once the segment is completely written
+    bytes 1-7       MAGIC, followed by the LAYOUT_VERSION byte
+    bytes 8-15      length of the JSON header
+    bytes 16-...    JSON header: the generation of the dataset, the number of rows and,
+                    for every column, its name, dtype, offset in the segment and
+                    categories (for categoricals)
+    next bytes      the column arrays, each aligned to 8 bytes
+
+The header is checked when attaching, so a process never reads a segment written with
+another layout, or holding another version of the dataset, as if it were its own.
+"""
+from multiprocessing import shared_memory, resource_tracker
+import atexit
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+HEADER_OFFSET = 16
+
+# Identifies the segments written by publish_frame(), and the version of their layout
+MAGIC = b'wsdata'
+LAYOUT_VERSION = 1
+
+# How long attach() waits for a segment that is still being written, in seconds
+READY_TIMEOUT = 60
+
+# The names of the segments created by this process
+_published = set()
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+def column_arrays(d_f: pd.DataFrame) -> list:
+    """
+    Splits a DataFrame into (name, array, categories) triples, where categorical columns
+    are represented by their codes and their list of categories.
+
+    Args:
+        d_f (pd.DataFrame): The dataset, with numeric and categorical columns only.
+
+    Returns:
+        list: The (name, array, categories) triples, categories being None for the
+        numeric columns.
+    """
+    columns = []
+    for name in d_f.columns:
+        if isinstance(d_f[name].dtype, pd.CategoricalDtype):
+            columns.append((name, d_f[name].array.codes,
+                            d_f[name].cat.categories.tolist()))
+        else:
+            columns.append((name, d_f[name].to_numpy(), None))
+    return columns
+
+def _unlink(segment):
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+def publish_frame(name: str, d_f: pd.DataFrame, generation: str = None) -> tuple:
+    """
+    Copies a DataFrame into a new shared memory segment.
+
+    If another process created the segment first, attaches to it instead. The segment is
+    removed when the process that created it exits; the processes attached to it keep
+    their mapping.
+
+    Args:
+        name (str): The name of the segment.
+        d_f (pd.DataFrame): The dataset, with numeric and categorical columns only.
+        generation (str): Identifies the version of the dataset, e.g. the version of the
+            file it was read from, or None.
+
+    Returns:
+        tuple: The SharedMemory segment and the DataFrame backed by it.
+
+    Raises:
+        ValueError: If another process created the segment first, but it does not hold
+            this generation of the dataset or removed it before it could be attached to.
+    """
+    columns = column_arrays(d_f)
+    header = {'generation': generation, 'rows': len(d_f), 'columns': []}
+    offset = 0
+    for column, array, categories in columns:
+        header['columns'].append({'name': column, 'dtype': array.dtype.str,
+                                  'offset': offset, 'categories': categories})
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = _align(HEADER_OFFSET + len(header_bytes))
+    try:
+        segment = shared_memory.SharedMemory(name, create=True,
+                                             size=max(data_offset + offset, 1))
+    except FileExistsError:
+        attached = attach_frame(name, generation)
+        if attached is None:
+            raise ValueError(f'Shared dataset {name} was removed while attaching to it') \
+                from None
+        return attached
+    _published.add(name)
+    atexit.register(_unlink, segment)
+
+    segment.buf[1:8] = MAGIC + bytes([LAYOUT_VERSION])
+    segment.buf[8:HEADER_OFFSET] = len(header_bytes).to_bytes(8, 'little')
+    segment.buf[HEADER_OFFSET:HEADER_OFFSET + len(header_bytes)] = header_bytes
+    for (_, array, _), meta in zip(columns, header['columns']):
+        np.ndarray(array.shape, array.dtype, buffer=segment.buf,
+                   offset=data_offset + meta['offset'])[:] = array
+    segment.buf[0] = 1
+
+    return segment, _frame(segment, header, data_offset)
+
+def attach_frame(name: str, generation: str = None) -> tuple:
+    """
+    Attaches to a shared memory segment published by another process, after checking
+    its header.
+
+    Args:
+        name (str): The name of the segment.
+        generation (str): The generation of the dataset the segment must hold, or None
+            to accept any.
+
+    Returns:
+        tuple: The SharedMemory segment and the DataFrame backed by it, or None if
+        there is no segment with this name.
+
+    Raises:
+        ValueError: If the segment was not written by publish_frame() with the current
+            layout, if its columns do not fit in it, or if it holds another generation
+            of the dataset.
+        TimeoutError: If the segment is not completely written within READY_TIMEOUT
+            seconds.
+    """
+    try:
+        segment = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return None
+    # Only the publisher owns the segment: keep the resource tracker from removing it
+    # when this process exits
+    if name not in _published:
+        resource_tracker.unregister(segment._name, 'shared_memory') # pylint: disable=protected-access
+
+    try:
+        header, data_offset = _read_header(segment, name)
+        if generation is not None and header['generation'] != generation:
+            raise ValueError(f"Shared dataset {name} holds generation "
+                             f"{header['generation']}, not {generation}")
+    except (ValueError, TimeoutError):
+        segment.close()
+        raise
+    return segment, _frame(segment, header, data_offset)
+
+def _read_header(segment, name: str) -> tuple:
+    """
+    Waits for a segment to be completely written, then reads and checks its header.
+
+    Returns:
+        tuple: The header and the offset of the column arrays.
+    """
+    if segment.size < HEADER_OFFSET:
+        raise ValueError(f'Shared dataset {name} has an unknown layout')
+
+    deadline = time.monotonic() + READY_TIMEOUT
+    while segment.buf[0] != 1:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Shared dataset {name} was never completely written')
+        time.sleep(0.05)
+    if bytes(segment.buf[1:8]) != MAGIC + bytes([LAYOUT_VERSION]):
+        raise ValueError(f'Shared dataset {name} has an unknown layout')
+
+    header_length = int.from_bytes(segment.buf[8:HEADER_OFFSET], 'little')
+    data_offset = _align(HEADER_OFFSET + header_length)
+    try:
+        header = json.loads(bytes(segment.buf[HEADER_OFFSET:HEADER_OFFSET + header_length]))
+        for meta in header['columns']:
+            end = data_offset + meta['offset'] + header['rows'] * np.dtype(meta['dtype']).itemsize
+            if meta['offset'] < 0 or end > segment.size:
+                raise ValueError(f"Column {meta['name']} does not fit in the segment")
+    except (ValueError, TypeError, KeyError) as error:
+        raise ValueError(f'Shared dataset {name} has an invalid header: {error}') from error
+    return header, data_offset
+
+def build_frame(columns: list) -> pd.DataFrame:
+    """
+    Builds a DataFrame on top of the arrays returned by column_arrays(), without copying
+    them.
+
+    Args:
+        columns (list): (name, array, categories) triples.
+
+    Returns:
+        pd.DataFrame: The dataset.
+    """
+    series = {}
+    for name, array, categories in columns:
+        if categories is not None:
+            array = pd.Categorical.from_codes(
+                array, dtype=pd.CategoricalDtype(categories), validate=False)
+        series[name] = pd.Series(array, copy=False)
+    return pd.DataFrame(series, copy=False)
+
+def _frame(segment, header: dict, data_offset: int) -> pd.DataFrame:
+    """
+    Builds a DataFrame whose columns are views on the arrays of a segment.
+    """
+    return build_frame([(meta['name'],
+                         np.ndarray((header['rows'],), np.dtype(meta['dtype']),
+                                    buffer=segment.buf, offset=data_offset + meta['offset']),
+                         meta['categories'])
+                        for meta in header['columns']])
@@ -0,0 +1,100 @@
+"""
+Module for the binary snapshot of the dataset, which spares the server from parsing the
+CSV file on every start.
+
+A snapshot is a directory holding one .npy file per column (categorical columns as their
+codes) and a meta.json file listing the columns and their categories. Its name is made
+of the modification time and size of the CSV file it was taken from, so a changed CSV
+file never matches an old snapshot. Loading a snapshot memory-maps the column files:
+pages are only read from disk when the data is used.
+"""
+from os import path, stat, makedirs, listdir, replace, getpid
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .shared_dataset import column_arrays, build_frame
+except ImportError:
+    # Imported as a top-level module, by the unit tests and the benchmarks
+    from shared_dataset import column_arrays, build_frame
+
+META_FILE = 'meta.json'
+
+def snapshot_path(directory: str, csv_path: str) -> str:
+    """
+    Returns the path of the snapshot of the current version of a CSV file.
+
+    Args:
+        directory (str): The directory holding the snapshots.
+        csv_path (str): The path to the CSV file.
+
+    Returns:
+        str: '<directory>/<CSV file name>-<mtime in ns>-<size>'.
+    """
+    csv_stat = stat(csv_path)
+    name = path.splitext(path.basename(csv_path))[0]
+    return path.join(directory, f'{name}-{csv_stat.st_mtime_ns}-{csv_stat.st_size}')
+
+def save_snapshot(directory: str, csv_path: str, d_f: pd.DataFrame):
+    """
+    Writes the snapshot of a dataset and removes the snapshots of older versions of
+    the CSV file.
+
+    The snapshot is written to a temporary directory which is then renamed, so a
+    process starting meanwhile never loads a partially written one.
+
+    Args:
+        directory (str): The directory holding the snapshots.
+        csv_path (str): The path to the CSV file the dataset was parsed from.
+        d_f (pd.DataFrame): The dataset, with numeric and categorical columns only.
+    """
+    snapshot = snapshot_path(directory, csv_path)
+    tmp_snapshot = f'{snapshot}.tmp-{getpid()}'
+    makedirs(tmp_snapshot, exist_ok=True)
+
+    meta = {'columns': []}
+    for i, (name, array, categories) in enumerate(column_arrays(d_f)):
+        np.save(path.join(tmp_snapshot, f'{i}.npy'), array, allow_pickle=False)
+        meta['columns'].append({'name': name, 'file': f'{i}.npy', 'categories': categories})
+    with open(path.join(tmp_snapshot, META_FILE), 'w', encoding='utf-8') as f_out:
+        json.dump(meta, f_out)
+
+    try:
+        replace(tmp_snapshot, snapshot)
+    except OSError:
+        # Another process saved the same snapshot first
+        shutil.rmtree(tmp_snapshot, ignore_errors=True)
+
+    prefix = path.basename(snapshot).rsplit('-', 2)[0] + '-'
+    for entry in listdir(directory):
+        if entry.startswith(prefix) and '.tmp-' not in entry \
+                and entry != path.basename(snapshot):
+            shutil.rmtree(path.join(directory, entry), ignore_errors=True)
+
+def load_snapshot(directory: str, csv_path: str) -> pd.DataFrame:
+    """
+    Loads the snapshot of the current version of a CSV file, with its columns
+    memory-mapped.
+
+    Args:
+        directory (str): The directory holding the snapshots.
+        csv_path (str): The path to the CSV file.
+
+    Returns:
+        pd.DataFrame: The dataset, or None if there is no snapshot of this version of
+        the CSV file.
+    """
+    snapshot = snapshot_path(directory, csv_path)
+    try:
+        with open(path.join(snapshot, META_FILE), 'r', encoding='utf-8') as f_in:
+            meta = json.load(f_in)
+    except FileNotFoundError:
+        return None
+    return build_frame([(column['name'],
+                         np.load(path.join(snapshot, column['file']), mmap_mode='r',
+                                 allow_pickle=False),
+                         column['categories'])
+                        for column in meta['columns']])
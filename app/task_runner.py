@@ -1,57 +1,251 @@
 """
 Module for the ThreadPool and TaskRunner classes.
 """
-from queue import Queue
-from threading import Thread
-from os import environ, cpu_count, path, makedirs
+from queue import Queue, PriorityQueue, Full, Empty
+from threading import Thread, Lock, Event
+from itertools import count
+from concurrent.futures import ProcessPoolExecutor
+from os import environ, cpu_count
+import logging
+import multiprocessing
+import pickle
+import time
 
-class ThreadPool:
+from app.job_registry import JobRegistry
+from app.result_store import ResultStore
+
+class ProcessWorker: # pylint: disable=too-few-public-methods
+    """
+    The state of a worker process of the process-pool backend.
+
+    Each worker process holds its own DataIngestor, which it receives pickled along with
+    the first job it computes on every version of the dataset (with DI_SHARED_MEMORY
+    set, the pickle is small: the process attaches to the shared memory segment of the
+    dataset instead of receiving a copy). Jobs are sent to the workers as
+    (endpoint, args) descriptors, since closures cannot be pickled.
+
+    Attributes:
+        data_ingestor (DataIngestor): The dataset of the current worker process.
+        generation (int): The version of the dataset held by the process, or None.
+    """
+    data_ingestor = None
+    generation = None
+
+    @staticmethod
+    def run(endpoint: str, args: tuple, generation: int, dataset: bytes = None) -> str:
+        """
+        Computes a job in the worker process, on a given version of the dataset.
+
+        Args:
+            endpoint (str): The name of the DataIngestor method, e.g. 'state_mean'.
+            args (tuple): The arguments of the method.
+            generation (int): The version of the dataset the job is computed on.
+            dataset (bytes): That version of the dataset, pickled, or None if the
+                process is expected to hold it already.
+
+        Returns:
+            str: The JSON result of the job, or None if the process holds another
+            version of the dataset and this one was not sent.
+        """
+        if dataset is not None:
+            ProcessWorker.data_ingestor = pickle.loads(dataset)
+            ProcessWorker.generation = generation
+        elif generation != ProcessWorker.generation:
+            return None
+        return getattr(ProcessWorker.data_ingestor, endpoint)(*args)()
+
+
+class ThreadPool: # pylint: disable=too-many-instance-attributes
     """
     A class representing a thread pool for executing tasks concurrently.
 
     The ThreadPool class manages a pool of threads that can execute tasks in parallel.
-    It takes a list of tasks as input and distributes them among the threads for execution.
+    Jobs are put in a queue and distributed among the threads for execution.
+
+    Jobs can be submitted before the dataset is loaded: the threads only start taking
+    them out of the queue once set_data_ingestor() was called. If the dataset could not
+    be loaded, the jobs fail instead of waiting in the queue forever.
+
+    The queue is a priority queue with aging: a job is queued with the key
+    submission time + priority * TP_PRIORITY_AGING, so the jobs of a given priority
+    go first, but only for TP_PRIORITY_AGING seconds (default 1) per priority level.
+    A cheap job is thus not stuck behind a backlog of expensive ones, and an expensive
+    job is not starved by a stream of cheap ones. Jobs of the same priority are run
+    in the order they were submitted.
+
+    With TP_EXECUTOR=process, the pandas work is moved out of the GIL to a pool of as
+    many worker processes as threads: the threads then only send the jobs to the
+    processes and wait for their results. The processes are spawned, not forked, as
+    forking a process running threads can leave locks held in the children. The pool
+    lives as long as the ThreadPool: when the dataset is replaced, the new one is sent
+    to the processes along with the jobs, instead of the pool being restarted.
 
     Attributes:
-        tasks (list): A list of tasks to be executed by the thread pool.
+        job_registry (JobRegistry): Tracks the state of every job.
         num_threads (int): The number of threads in the thread pool.
-        queue (Queue): A queue to store the tasks.
+        queue (PriorityQueue): A queue to store the tasks, holding at most
+            TP_MAX_QUEUE_SIZE jobs (unbounded if the variable is not set or 0).
+        priority_aging (float): The number of seconds a job waits in the queue before it
+            goes before the jobs with a priority one level more urgent.
+        sequence (count): Breaks ties between jobs with the same key.
+        rejected_jobs (int): The number of jobs rejected because the queue was full.
+        submit_lock (Lock): Serializes the submissions, so that a job is only registered
+            once the queue has room for it, and protects rejected_jobs.
+        result_store (ResultStore): Where the results of the jobs are saved.
         threads (list): A list of TaskRunner threads.
+        dataset (tuple): The version of the dataset the jobs are computed on (0 until it
+            is loaded, then incremented every time it is replaced), the DataIngestor
+            (None if it could not be loaded) and, with the process backend, the pickled
+            DataIngestor sent to the worker processes. Replaced as a whole, so a job
+            reads a consistent version.
+        ready (Event): Set once the dataset is loaded, or could not be.
+        executor (ProcessPoolExecutor): The worker processes, or None with the
+            default thread backend.
 
     Methods:
-        __init__(self, tasks: list = []): Initializes the ThreadPool object.
+        __init__(self, job_registry: JobRegistry, result_store: ResultStore): Initializes
+        the ThreadPool object.
+        set_data_ingestor(self, data_ingestor: DataIngestor): Sets the dataset and starts
+        running the queued jobs.
+        job(self, endpoint: str, *args) -> function: Builds the job answering a request.
+        submit(self, endpoint: str, job: function, priority: int) -> int: Registers and
+        queues a job, or raises queue.Full.
+        complete(self, job_id: int, result: bytes): Records the result of a job that did
+        not need to go through the queue.
         shutdown(self): Shuts down the task runner by joining all the threads
         and stopping their execution.
     """
 
-    def __init__(self, tasks: list):
-        self.tasks = tasks
+    def __init__(self, job_registry: JobRegistry, result_store: ResultStore):
+        self.job_registry = job_registry
+        self.result_store = result_store
 
         if environ.get('TP_NUM_OF_THREADS') is not None:
-            self.num_threads = environ.get('TP_NUM_OF_THREADS')
+            self.num_threads = int(environ.get('TP_NUM_OF_THREADS'))
         else:
             self.num_threads = cpu_count()
 
-        if not path.exists('results'):
-            makedirs('results')
-
-        self.queue = Queue()
-        self.threads = [TaskRunner(self.tasks, self.queue) for i in range(self.num_threads)]
+        self.queue = PriorityQueue(int(environ.get('TP_MAX_QUEUE_SIZE', 0)))
+        self.priority_aging = float(environ.get('TP_PRIORITY_AGING', 1))
+        self.sequence = count()
+        self.rejected_jobs = 0
+        self.submit_lock = Lock()
+        self.dataset = (0, None, None)
+        self.ready = Event()
+        self.executor = None
+        if environ.get('TP_EXECUTOR') == 'process':
+            # Spawned rather than forked, since the webserver already runs threads
+            self.executor = ProcessPoolExecutor(self.num_threads,
+                                                multiprocessing.get_context('spawn'))
+        self.threads = [TaskRunner(self.job_registry, self.queue, self.result_store, self.ready)
+                        for i in range(self.num_threads)]
         for thread in self.threads:
             thread.start()
 
+    def set_data_ingestor(self, data_ingestor):
+        """
+        Sets the dataset the jobs are computed on, and lets the threads run the jobs
+        queued meanwhile. With the process backend, the dataset is pickled once, to be
+        sent to each worker process along with its first job on this version.
+
+        When the dataset is replaced, the jobs already running finish on the old one.
+
+        Args:
+            data_ingestor (DataIngestor): The dataset the jobs are computed on, or None if
+                it could not be loaded, in which case the jobs fail until one is set.
+        """
+        pickled = None
+        if self.executor is not None and data_ingestor is not None:
+            pickled = pickle.dumps(data_ingestor, protocol=pickle.HIGHEST_PROTOCOL)
+        self.dataset = (self.dataset[0] + 1, data_ingestor, pickled)
+        self.ready.set()
+
+    def job(self, endpoint: str, *args):
+        """
+        Builds the job answering a request.
+
+        The dataset is only looked up when the job runs, so jobs can be built before
+        it is loaded.
+
+        Args:
+            endpoint (str): The name of the DataIngestor method, e.g. 'state_mean'.
+            *args: The arguments of the method, e.g. the question and the state.
+
+        Returns:
+            function: A closure computing the JSON result of the job, either directly or
+            by sending the (endpoint, args) descriptor to a worker process. It raises
+            RuntimeError if the dataset could not be loaded.
+        """
+        def run():
+            generation, data_ingestor, pickled = self.dataset
+            if data_ingestor is None:
+                raise RuntimeError('The dataset could not be loaded')
+            if self.executor is None:
+                return getattr(data_ingestor, endpoint)(*args)()
+            result = self.executor.submit(ProcessWorker.run, endpoint, args,
+                                          generation).result()
+            if result is None:
+                # The process does not hold this version of the dataset yet
+                result = self.executor.submit(ProcessWorker.run, endpoint, args,
+                                              generation, pickled).result()
+            return result
+        return run
+
+    def submit(self, endpoint: str, job, priority: int = 0) -> int:
+        """
+        Registers a job and queues it to be executed by one of the threads.
+
+        The job ID is only allocated once the queue has room for the job, so rejected
+        jobs leave no gaps in the sequence of job IDs.
+
+        Args:
+            endpoint (str): The name of the DataIngestor method, e.g. 'state_mean'.
+            job (function): The closure computing the JSON result of the job, as bytes.
+            priority (int): The priority of the job, 0 being the most urgent.
+
+        Returns:
+            int: The ID of the job.
+
+        Raises:
+            Full: If the queue already holds TP_MAX_QUEUE_SIZE jobs; the job is dropped.
+        """
+        key = time.monotonic() + priority * self.priority_aging
+        with self.submit_lock:
+            # Only the submissions fill the queue, so it cannot fill up before put_nowait()
+            if self.queue.full():
+                self.rejected_jobs += 1
+                raise Full
+            job_id = self.job_registry.create(endpoint).job_id
+            self.queue.put_nowait((key, next(self.sequence), job_id, job))
+        return job_id
+
+    def complete(self, job_id: int, result: bytes):
+        """
+        Records the result of a job that did not need to go through the queue,
+        e.g. one answered from the result cache.
+
+        Args:
+            job_id (int): The ID of the job.
+            result (bytes): The JSON result of the job.
+        """
+        self.result_store.put(job_id, result)
+        self.job_registry.finish(job_id)
+
     def shutdown(self):
         """
         Shuts down the task runner by joining all the threads and stopping their execution.
 
         This method waits for all the tasks in the queue to be processed and then stops all
-        the threads by setting their `shutdown` flag to True and joining them.
+        the threads by setting their `shutdown` flag to True and joining them. If the dataset
+        could not be loaded, the queued tasks fail right away rather than being waited for.
 
         """
         self.queue.join()
         for thread in self.threads:
             thread.shutdown = True
             thread.join()
+        if self.executor is not None:
+            self.executor.shutdown()
 
 
 class TaskRunner(Thread):
@@ -59,32 +253,44 @@ class TaskRunner(Thread):
     A class representing a task runner that executes tasks in a thread.
 
     The TaskRunner class is a subclass of the Thread class and is responsible for executing
-    tasks in a separate thread. It retrieves tasks from a queue, executes them, and writes
-    the results to the corresponding files.
+    tasks in a separate thread. It retrieves tasks from a queue, executes them, and saves
+    the results to the result store.
 
     Attributes:
-        tasks (list): A list of tasks to be executed.
+        job_registry (JobRegistry): Tracks the state of every job.
         queue (Queue): A queue to store the tasks.
+        result_store (ResultStore): Where the results of the jobs are saved.
+        ready (Event): Set once the dataset is loaded, or could not be; no job is run
+            before.
+        busy (bool): Whether the thread is computing a job.
+        busy_time (float): The total number of seconds spent computing jobs.
         shutdown (bool): A flag to indicate whether the task runner should be shut down.
 
     Methods:
         run(self): Executes the tasks in the queue until the shutdown flag is set.
     """
 
-    def __init__(self, tasks: list, queue: Queue):
+    def __init__(self, job_registry: JobRegistry, queue: Queue, result_store: ResultStore,
+                 ready: Event):
         """
         Initializes a TaskRunner object.
 
         Args:
-            tasks (list): A list of tasks.
+            job_registry (JobRegistry): Tracks the state of every job.
             queue (Queue): A queue to store the tasks.
+            result_store (ResultStore): Where the results of the jobs are saved.
+            ready (Event): Set once the dataset is loaded, or could not be.
 
         Returns:
             None
         """
         Thread.__init__(self)
-        self.tasks = tasks
+        self.job_registry = job_registry
         self.queue = queue
+        self.result_store = result_store
+        self.ready = ready
+        self.busy = False
+        self.busy_time = 0.0
         self.shutdown = False
 
     def run(self):
@@ -92,9 +298,10 @@ class TaskRunner(Thread):
         Executes the tasks in the queue until the shutdown flag is set.
 
         This method continuously retrieves tasks from the queue, executes them,
-        and writes the results to the corresponding files. If an exception occurs
-        during task execution, it is caught and the loop continues. The method also
-        appends the completed task to the list of tasks.
+        and saves the results to the result store. The job registry is told when
+        a job starts and when it is done, which wakes up the clients waiting for its
+        result. If an exception occurs during task execution, the job is marked as
+        failed and the loop continues.
 
         Note: This method will block if the queue is empty, waiting for new tasks to be added.
 
@@ -103,11 +310,23 @@ class TaskRunner(Thread):
         """
         while True:
             try:
-                job = self.queue.get(block=True, timeout=1)
-                with open(f'results/{job[0]}', 'a', encoding='utf-8') as f_out:
-                    f_out.write(job[1]())
-                self.queue.task_done()
-                self.tasks.append(job[0])
-            except Exception:
+                if not self.ready.wait(timeout=1):
+                    raise Empty
+                _, _, job_id, job = self.queue.get(block=True, timeout=1)
+            except Empty:
                 if self.shutdown:
                     break
+                continue
+
+            self.busy = True
+            start = time.perf_counter()
+            self.job_registry.start(job_id)
+            try:
+                self.result_store.put(job_id, job())
+                self.job_registry.finish(job_id)
+            except Exception: # pylint: disable=broad-exception-caught
+                logging.getLogger('webserver').exception('Job %d failed', job_id)
+                self.job_registry.fail(job_id)
+            self.busy_time += time.perf_counter() - start
+            self.busy = False
+            self.queue.task_done()
@@ -0,0 +1,8 @@
+from os import environ
+
+from app import create_app
+from app.asgi import ASGIApp
+
+webserver = create_app()
+app = ASGIApp(webserver, int(environ.get('ASGI_THREADS', 8)))
+# Serve with an ASGI server, e.g. 'uvicorn asgi_server:app'
@@ -0,0 +1,150 @@
+"""
+Micro-benchmark of every DataIngestor method on unittests/test.csv and on copies of it
+scaled up to 10x and 100x rows, recording the time and the peak memory of each call.
+
+The report is printed as a table and can be written as JSON with --json; --compare
+prints the time ratio of every measurement against an older JSON report.
+
+Usage:
+    python benchmarks/bench_data_ingestor.py [csv_path] [--scales 1 10 100]
+        [--repeat N] [--json report.json] [--compare old_report.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+app_dir = os.path.join(current_dir, '..', 'app')
+sys.path.append(app_dir)
+
+from data_ingestor import DataIngestor
+
+def scaled_csv(csv_path: str, scale: int, directory: str) -> str:
+    """
+    Writes a CSV file holding `scale` copies of the rows of another one, and returns
+    its path. Every copy keeps the same questions, states and stratifications, but is
+    moved to years of its own, so each question and state has `scale` times more cells
+    in the index, instead of the same cells holding more rows.
+    """
+    if scale == 1:
+        return csv_path
+    d_f = pd.read_csv(csv_path)
+    span = d_f['YearEnd'].max() - d_f['YearStart'].min() + 1
+    copies = [d_f.assign(YearStart=d_f['YearStart'] + i * span,
+                         YearEnd=d_f['YearEnd'] + i * span)
+              for i in range(scale)]
+    scaled_path = os.path.join(directory, f'scaled_{scale}x.csv')
+    pd.concat(copies, ignore_index=True).to_csv(scaled_path, index=False)
+    return scaled_path
+
+def calls(d_i: DataIngestor) -> dict:
+    """
+    Returns a call of every DataIngestor method, on the first question and state of the
+    dataset.
+    """
+    question = d_i.d_f['Question'].iloc[0]
+    state = d_i.d_f.loc[d_i.d_f['Question'] == question, 'LocationDesc'].iloc[0]
+    queries = [('states_mean', question), ('state_mean', question, state),
+               ('best5', question), ('worst5', question), ('global_mean', question),
+               ('diff_from_mean', question), ('state_diff_from_mean', question, state),
+               ('mean_by_category', question),
+               ('state_mean_by_category', question, state)]
+    methods = {query[0]: query[1:] for query in queries}
+    methods['batch'] = tuple(queries)
+    return {method: lambda method=method, args=args: getattr(d_i, method)(*args)()
+            for method, args in methods.items()}
+
+def peak_memory(func) -> int:
+    """
+    Returns the peak number of bytes allocated while calling func.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def best_time(func, repeat: int) -> float:
+    """
+    Returns the best time of a single call of func, in seconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=repeat)) / number
+
+def bench_dataset(csv_path: str, repeat: int) -> dict:
+    """
+    Loads a dataset and measures every DataIngestor method on it.
+    """
+    start = time.perf_counter()
+    d_i = DataIngestor(csv_path)
+    load_time = time.perf_counter() - start
+
+    result = {'rows': len(d_i.d_f), 'index_cells': sum(map(len, d_i.index.values())),
+              'load_seconds': load_time,
+              'load_peak_bytes': peak_memory(lambda: DataIngestor(csv_path)),
+              'index_build_seconds': d_i.index_build_time, 'methods': {}}
+    for method, call in calls(d_i).items():
+        result['methods'][method] = {'seconds': best_time(call, repeat),
+                                     'peak_bytes': peak_memory(call)}
+    return result
+
+def print_report(report: dict, baseline: dict):
+    """
+    Prints a report as a table, with the time ratios against a baseline report if any.
+    """
+    header = f'{"dataset":<8}{"method":<24}{"time (us)":>12}{"peak (KiB)":>12}'
+    print(header + (f'{"vs baseline":>13}' if baseline else ''))
+    for dataset, result in report['datasets'].items():
+        print(f'{dataset:<8}{"load":<24}{result["load_seconds"] * 1e6:>12.0f}'
+              f'{result["load_peak_bytes"] / 1024:>12.0f}'
+              f'  ({result["rows"]} rows, {result["index_cells"]} index cells)')
+        for method, measure in result['methods'].items():
+            line = (f'{dataset:<8}{method:<24}{measure["seconds"] * 1e6:>12.1f}'
+                    f'{measure["peak_bytes"] / 1024:>12.1f}')
+            old = baseline.get('datasets', {}).get(dataset, {}).get('methods', {}).get(method)
+            if old is not None:
+                line += f'{measure["seconds"] / old["seconds"]:>12.2f}x'
+            print(line)
+
+def main():
+    """
+    Benchmarks every scale of the dataset and prints the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('csv_path', nargs='?',
+                        default=os.path.join(current_dir, '..', 'unittests', 'test.csv'))
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--compare', help='a previous JSON report to compare against')
+    args = parser.parse_args()
+
+    report = {'python': platform.python_version(), 'pandas': pd.__version__,
+              'csv_path': args.csv_path, 'datasets': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            report['datasets'][f'{scale}x'] = bench_dataset(
+                scaled_csv(args.csv_path, scale, directory), args.repeat)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f_in:
+            baseline = json.load(f_in)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f_out:
+            json.dump(report, f_out, indent=2)
+
+if __name__ == '__main__':
+    main()
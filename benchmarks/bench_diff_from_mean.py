@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of diff_from_mean and state_diff_from_mean: the original implementation,
+which filters the whole table twice and runs a Python lambda per state, against the
+DataIngestor one, which reduces the precomputed index with a single groupby and a
+broadcast subtraction.
+
+Usage:
+    python benchmarks/bench_diff_from_mean.py [csv_path] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+current_dir = os.path.dirname(__file__)
+app_dir = os.path.join(current_dir, '..', 'app')
+sys.path.append(app_dir)
+
+from data_ingestor import DataIngestor
+
+def legacy_diff_from_mean(d_f, question: str) -> str:
+    """
+    The original diff_from_mean: two full-table filters and a lambda per state.
+    """
+    global_mean = d_f.loc[d_f['Question'] == question]['Data_Value'].mean()
+    return d_f.loc[d_f['Question'] == question] \
+        .groupby('LocationDesc')['Data_Value'].apply(lambda x: global_mean - x.mean()) \
+        .to_json()
+
+def legacy_state_diff_from_mean(d_f, question: str, state: str) -> float:
+    """
+    The original state_diff_from_mean: two full-table filters.
+    """
+    global_mean = d_f.loc[d_f['Question'] == question]['Data_Value'].mean()
+    return global_mean - d_f.loc[(d_f['Question'] == question)
+                                 & (d_f['LocationDesc'] == state)]['Data_Value'].mean()
+
+def best_time(func, repeat: int) -> float:
+    """
+    Returns the best time of a single call of func, in seconds.
+    """
+    number = 10
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+def main():
+    """
+    Times both implementations for every question of the dataset and prints the speedup.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('csv_path', nargs='?',
+                        default='./nutrition_activity_obesity_usa_subset.csv')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    d_i = DataIngestor(args.csv_path)
+    print(f'{len(d_i.d_f)} rows, index built in {d_i.index_build_time * 1000:.1f} ms')
+    print(f'{"endpoint":<22}{"legacy (ms)":>14}{"indexed (ms)":>14}{"speedup":>10}')
+
+    for endpoint in ['diff_from_mean', 'state_diff_from_mean']:
+        legacy_total = indexed_total = 0
+        for question in d_i.index:
+            if endpoint == 'diff_from_mean':
+                legacy_total += best_time(lambda q=question: legacy_diff_from_mean(d_i.d_f, q),
+                                          args.repeat)
+                indexed_total += best_time(d_i.diff_from_mean(question), args.repeat)
+            else:
+                state = d_i.d_f['LocationDesc'].iloc[0]
+                legacy_total += best_time(
+                    lambda q=question, s=state: legacy_state_diff_from_mean(d_i.d_f, q, s),
+                    args.repeat)
+                indexed_total += best_time(d_i.state_diff_from_mean(question, state),
+                                           args.repeat)
+
+        legacy_ms = legacy_total / len(d_i.index) * 1000
+        indexed_ms = indexed_total / len(d_i.index) * 1000
+        print(f'{endpoint:<22}{legacy_ms:>14.3f}{indexed_ms:>14.3f}'
+              f'{legacy_ms / indexed_ms:>9.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+Load-generation benchmark of the webserver: replays the checker's request payloads
+(tests/<endpoint>/input/*.json) or the request mix recorded in webserver.log at a
+given concurrency and rate, and reports the throughput, the end-to-end latency
+percentiles (from the POST to the 'done' result, polling included) and the error rates.
+
+Unless --url is given, a server is launched locally with 'flask run' for the run and
+shut down afterwards; it logs to a temporary file, so webserver.log is left as is.
+
+Usage:
+    python benchmarks/load_test.py [--mix tests|log] [--concurrency N] [--rate R]
+                                   [--requests N] [--url URL] [--json report.json]
+"""
+import argparse
+import ast
+import itertools
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+current_dir = os.path.dirname(__file__)
+root_dir = os.path.join(current_dir, '..')
+
+LOG_REQUEST = re.compile(r' - INFO - POST \S+/api/(\w+) (\{.*\})$')
+
+# How long a job may take before it is counted as timed out, in seconds
+JOB_TIMEOUT = 30
+
+def tests_mix() -> list:
+    """
+    Returns the (endpoint, body) pairs of the checker's input files.
+    """
+    mix = []
+    tests_dir = os.path.join(root_dir, 'tests')
+    for endpoint in sorted(os.listdir(tests_dir)):
+        input_dir = os.path.join(tests_dir, endpoint, 'input')
+        for input_file in sorted(os.listdir(input_dir)):
+            with open(os.path.join(input_dir, input_file), 'r', encoding='utf-8') as f_in:
+                mix.append((endpoint, json.load(f_in)))
+    return mix
+
+def log_mix(log_path: str) -> list:
+    """
+    Returns the (endpoint, body) pairs of the POST requests logged by the server, in
+    the order they were received.
+    """
+    mix = []
+    with open(log_path, 'r', encoding='utf-8') as f_in:
+        for line in f_in:
+            match = LOG_REQUEST.search(line.rstrip('\n'))
+            if match is not None:
+                mix.append((match.group(1), ast.literal_eval(match.group(2))))
+    return mix
+
+def percentile(samples: list, quantile: float) -> float:
+    """
+    Returns a percentile of sorted samples, by the nearest-rank method.
+    """
+    if not samples:
+        return float('nan')
+    return samples[max(0, math.ceil(quantile * len(samples)) - 1)]
+
+class LoadGenerator:
+    """
+    Sends requests from several threads and records their outcome.
+
+    Request i is sent at start + i / rate (as soon as a thread is free if the rate is 0),
+    and its result is polled until it is done, failed or timed out.
+
+    Attributes:
+        url (str): The base URL of the server.
+        mix (list): The (endpoint, body) pairs, replayed in order and cycled.
+        total (int): The number of requests to send.
+        rate (float): Requests per second, or 0 for as fast as the threads allow.
+        poll_interval (float): Seconds between two polls of a job's result.
+        wait (float): The '?wait=' long-polling timeout, or 0 for plain polling.
+        latencies (defaultdict): endpoint -> end-to-end latencies of the done jobs.
+        errors (Counter): (endpoint, kind) -> number of failed requests.
+    """
+
+    def __init__(self, url: str, mix: list, total: int, rate: float,
+                 poll_interval: float, wait: float):
+        self.url = url
+        self.mix = mix
+        self.total = total
+        self.rate = rate
+        self.poll_interval = poll_interval
+        self.wait = wait
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.indices = itertools.count()
+        self.lock = threading.Lock()
+        self.start = None
+
+    def run(self, concurrency: int) -> float:
+        """
+        Sends all the requests and returns how long it took, in seconds.
+        """
+        self.start = time.perf_counter()
+        threads = [threading.Thread(target=self.worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - self.start
+
+    def worker(self):
+        """
+        Sends requests until all of them were sent.
+        """
+        session = requests.Session()
+        while True:
+            with self.lock:
+                i = next(self.indices)
+            if i >= self.total:
+                return
+            if self.rate:
+                delay = self.start + i / self.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            endpoint, body = self.mix[i % len(self.mix)]
+            outcome, latency = self.request(session, endpoint, body)
+            with self.lock:
+                if outcome == 'done':
+                    self.latencies[endpoint].append(latency)
+                else:
+                    self.errors[(endpoint, outcome)] += 1
+
+    def request(self, session: requests.Session, endpoint: str, body: dict) -> tuple:
+        """
+        Sends a request and polls its result.
+
+        Returns:
+            tuple: The outcome ('done', 'rejected', 'http <code>', 'failed',
+            'timeout' or 'connection') and the end-to-end latency in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            response = session.post(f'{self.url}/api/{endpoint}', json=body)
+            if response.status_code == 429:
+                return 'rejected', None
+            if response.status_code != 200:
+                return f'http {response.status_code}', None
+            data = response.json()
+            job_id = data.get('job_id')
+
+            params = {'wait': self.wait} if self.wait else None
+            while data['status'] == 'running':
+                if time.perf_counter() - start > JOB_TIMEOUT:
+                    return 'timeout', None
+                if not self.wait:
+                    time.sleep(self.poll_interval)
+                data = session.get(f'{self.url}/api/get_results/{job_id}', params=params).json()
+        except requests.RequestException:
+            return 'connection', None
+
+        if data['status'] != 'done':
+            return 'failed', None
+        return 'done', time.perf_counter() - start
+
+    def report(self, elapsed: float) -> dict:
+        """
+        Returns the throughput, the latency percentiles and the error counts of the run.
+        """
+        def summary(latencies: list) -> dict:
+            latencies = sorted(latencies)
+            return {'count': len(latencies),
+                    **{f'p{int(q * 100)}': percentile(latencies, q)
+                       for q in [0.5, 0.9, 0.95, 0.99]},
+                    'max': latencies[-1] if latencies else float('nan')}
+
+        done = sum(len(latencies) for latencies in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            'requests': self.total,
+            'elapsed': elapsed,
+            'throughput': done / elapsed,
+            'error_rate': errors / self.total if self.total else 0,
+            'latency': summary(list(itertools.chain(*self.latencies.values()))),
+            'endpoints': {endpoint: summary(latencies)
+                          for endpoint, latencies in sorted(self.latencies.items())},
+            'errors': {f'{endpoint} {kind}': count
+                       for (endpoint, kind), count in sorted(self.errors.items())},
+        }
+
+def launch_server(port: int, log_file: str) -> subprocess.Popen:
+    """
+    Starts the webserver with 'flask run' and waits until its dataset is loaded. The
+    server logs to log_file, so the replayed requests are not added to webserver.log.
+    """
+    server = subprocess.Popen([sys.executable, '-m', 'flask', 'run', '--port', str(port)],
+                              cwd=root_dir, env={**os.environ, 'LOG_FILE': log_file},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/api/ready', timeout=1).ok:
+                return server
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    server.kill()
+    sys.exit('The server did not become ready')
+
+def print_report(report: dict):
+    """
+    Prints a report as a table.
+    """
+    print(f'{report["requests"]} requests in {report["elapsed"]:.2f} s: '
+          f'{report["throughput"]:.1f} jobs/s, error rate {report["error_rate"]:.2%}')
+    print(f'{"endpoint":<24}{"count":>7}' + ''.join(f'{p + " (ms)":>11}' for p in
+                                                   ['p50', 'p90', 'p95', 'p99', 'max']))
+    for endpoint, summary in [('all', report['latency'])] + list(report['endpoints'].items()):
+        print(f'{endpoint:<24}{summary["count"]:>7}'
+              + ''.join(f'{summary[p] * 1000:>11.2f}'
+                        for p in ['p50', 'p90', 'p95', 'p99', 'max']))
+    for error, count in report['errors'].items():
+        print(f'error: {error}: {count}')
+
+def main():
+    """
+    Runs the benchmark and prints its report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--mix', choices=['tests', 'log'], default='tests')
+    parser.add_argument('--log', default=os.path.join(root_dir, 'webserver.log'),
+                        help='the log replayed with --mix log')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='requests per second, 0 for as fast as possible')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--poll-interval', type=float, default=0.01)
+    parser.add_argument('--wait', type=float, default=0,
+                        help="poll with get_results?wait=<seconds> instead")
+    parser.add_argument('--url', help='benchmark a running server instead of launching one')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    mix = tests_mix() if args.mix == 'tests' else log_mix(args.log)
+    if not mix:
+        sys.exit('No requests to replay')
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        server = None
+        url = args.url
+        if url is None:
+            server = launch_server(args.port, os.path.join(log_dir, 'webserver.log'))
+            url = f'http://127.0.0.1:{args.port}'
+
+        try:
+            generator = LoadGenerator(url, mix, args.requests, args.rate,
+                                      args.poll_interval, args.wait)
+            report = generator.report(generator.run(args.concurrency))
+        finally:
+            if server is not None:
+                requests.get(f'{url}/api/graceful_shutdown', timeout=30)
+                server.terminate()
+                server.wait()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f_out:
+            json.dump(report, f_out, indent=2)
+
+if __name__ == '__main__':
+    main()
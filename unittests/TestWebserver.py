@@ -1,12 +1,35 @@
 import unittest
+import asyncio
+import json
+import logging
 import os
+import pickle
 import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+from unittest import mock
+
+import pandas as pd
+from flask import Flask, jsonify, request
 
 current_dir = os.path.dirname(__file__)
 app_dir = os.path.join(current_dir, '..', 'app')
 sys.path.append(app_dir)
 
 from data_ingestor import DataIngestor
+from result_cache import ResultCache
+from result_store import MemoryResultStore, FileResultStore, CHUNK_SIZE
+from job_registry import JobRegistry, JobState
+from shared_dataset import publish_frame, attach_frame
+import shared_dataset
+from snapshot import snapshot_path
+from metrics import Metrics
+from task_runner import ThreadPool
+from serializer import series_json, dumps, loads
+from asgi import ASGIApp
+from app import create_app
 
 class TestWebserver(unittest.TestCase):
 
@@ -136,5 +159,853 @@ class TestWebserver(unittest.TestCase):
         with open("unittests/input/state_mean_by_category.json", "r", encoding='utf-8') as f_in:
             self.assertEqual(f_in.read(), d_i.state_mean_by_category(question, state)())
 
+    def test_batch(self):
+        """
+        Test case for the batch method of the DataIngestor class.
+        It checks that the result is the list of the results of every query, in order.
+        """
+        d_i = DataIngestor("unittests/test.csv")
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        state = "Wisconsin"
+        result = json.loads(d_i.batch(('best5', question), ('state_mean', question, state))())
+        with open("unittests/input/best5.json", "r", encoding='utf-8') as f_in:
+            self.assertEqual(json.load(f_in), result[0])
+        with open("unittests/input/state_mean.json", "r", encoding='utf-8') as f_in:
+            self.assertEqual(json.load(f_in), result[1])
+
+    def test_build_index(self):
+        """
+        Test case for the aggregate index built by the DataIngestor class.
+        It checks that every cell holds the sum and count of its 'Data_Value' entries.
+        """
+        d_i = DataIngestor("unittests/test.csv")
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        cell = d_i.aggregates(question).loc[('Wisconsin', 'Age (years)', '35 - 44', 2022, 2022)]
+        self.assertEqual(30.3, cell['sum'])
+        self.assertEqual(1, cell['count'])
+        self.assertTrue(d_i.aggregates("Unknown question").empty)
+
+    def test_estimate_cost(self):
+        """
+        Test case for the estimate_cost method of the DataIngestor class.
+        It checks that grouped endpoints are estimated to cost more than scalar ones.
+        """
+        d_i = DataIngestor("unittests/test.csv")
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        self.assertEqual(21, d_i.estimate_cost('global_mean', question))
+        self.assertLess(d_i.estimate_cost('state_mean', question),
+                        d_i.estimate_cost('mean_by_category', question))
+        self.assertEqual(0, d_i.estimate_cost('states_mean', "Unknown question"))
+
+    def test_compact_dataset(self):
+        """
+        Test case for the compact loading mode of the DataIngestor class.
+        It checks that the dataset shrinks and the results stay within the checker's epsilon.
+        """
+        d_i = DataIngestor("unittests/test.csv", compact=True)
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        self.assertLess(d_i.memory_usage[1], d_i.memory_usage[0])
+        self.assertEqual('category', d_i.d_f['Question'].dtype)
+        with open("unittests/input/global_mean.json", "r", encoding='utf-8') as f_in:
+            self.assertAlmostEqual(json.load(f_in)['global_mean'],
+                                   json.loads(d_i.global_mean(question)())['global_mean'],
+                                   delta=0.01)
+
+    def test_result_cache(self):
+        """
+        Test case for the ResultCache class.
+        It checks the LRU eviction, the hit/miss counters and the invalidation on clear.
+        """
+        cache = ResultCache(2)
+        cache.put(('best5', 'q1'), b'{"a": 1}', cache.generation)
+        cache.put(('best5', 'q2'), b'{"b": 2}', cache.generation)
+        self.assertEqual(b'{"a": 1}', cache.get(('best5', 'q1')))
+        cache.put(('best5', 'q3'), b'{"c": 3}', cache.generation)
+        self.assertIsNone(cache.get(('best5', 'q2')))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+        job = cache.wrap(('global_mean', 'q1'), lambda: '{"global_mean": 1.0}')
+        cache.clear()
+        self.assertEqual(b'{"global_mean": 1.0}', job())
+        self.assertIsNone(cache.get(('global_mean', 'q1')))
+        self.assertIsNone(cache.get(('best5', 'q1')))
+
+        # The generation was read before a clear() the job is wrapped after
+        generation = cache.generation
+        cache.clear()
+        cache.wrap(('global_mean', 'q1'), lambda: '{"global_mean": 1.0}', generation)()
+        self.assertIsNone(cache.get(('global_mean', 'q1')))
+
+    def test_job_registry(self):
+        """
+        Test case for the JobRegistry class.
+        It checks that job IDs are distinct, that states and timestamps are tracked, and
+        that done callbacks are called once the job ends, unless they were removed.
+        """
+        registry = JobRegistry()
+        first, second = registry.create('best5'), registry.create('state_mean')
+        self.assertEqual((1, 2), (first.job_id, second.job_id))
+        self.assertEqual('running', first.status)
+
+        registry.start(1)
+        self.assertEqual(JobState.RUNNING, first.state)
+        registry.finish(1)
+        registry.fail(2)
+        self.assertEqual(('done', 'error'), (first.status, second.status))
+        self.assertLessEqual(first.submitted_at, first.started_at)
+        self.assertLessEqual(first.started_at, first.finished_at)
+        self.assertFalse(registry.add_done_callback(1, lambda: None))
+
+        third = registry.create('best5')
+        self.assertEqual([first, second, third], registry.page(0, None))
+        self.assertEqual([third], registry.page(2, 1))
+        self.assertEqual((1, 2), (registry.running_jobs, registry.done_jobs))
+
+        called = []
+        removed = lambda: called.append('removed')
+        self.assertTrue(registry.add_done_callback(3, lambda: called.append('kept')))
+        self.assertTrue(registry.add_done_callback(3, removed))
+        registry.remove_done_callback(3, removed)
+        registry.wait(3, 0.01)
+        self.assertEqual(1, len(third.callbacks))
+        registry.finish(3)
+        registry.wait(3, 10)
+        self.assertEqual(['kept'], called)
+
+    def test_asgi(self):
+        """
+        Test case for the ASGIApp class.
+        It checks that a long-polling request is answered, with its result streamed from
+        a file, as soon as its job ends, that a request giving up on a job leaves no
+        callback behind, that unknown jobs are reported, that the other routes are
+        served by Flask, and that the shutdown of the ASGI server stops the tasks runner.
+        """
+        webserver = Flask(__name__)
+        webserver.shutdown = False
+        webserver.poll_log_rate = 0
+        webserver.job_registry = JobRegistry()
+        with mock.patch.dict(os.environ, {'TP_NUM_OF_THREADS': '2'}):
+            webserver.tasks_runner = ThreadPool(webserver.job_registry, MemoryResultStore(60, 10))
+        webserver.result_store = FileResultStore(self.enterContext(tempfile.TemporaryDirectory()))
+
+        @webserver.route('/api/echo', methods=['POST'])
+        def echo():
+            return jsonify({'data': request.json, 'token': request.headers.get('X-Token')})
+
+        app = ASGIApp(webserver, 1)
+        job = webserver.job_registry.create('global_mean')
+
+        def finish():
+            webserver.result_store.put(job.job_id, b'{"global_mean": 32.9}')
+            webserver.job_registry.finish(job.job_id)
+
+        async def call(method, path, query_string=b'', body=b'', headers=()):
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': body}
+
+            async def send(message):
+                messages.append(message)
+
+            await app({'type': 'http', 'method': method, 'path': path, 'root_path': '',
+                       'query_string': query_string, 'headers': list(headers)},
+                      receive, send)
+            return messages[0]['status'], json.loads(b''.join(
+                message.get('body', b'') for message in messages[1:]))
+
+        async def main():
+            threading.Timer(0.1, finish).start()
+            start = time.monotonic()
+            result = await call('GET', f'/api/get_results/{job.job_id}', b'wait=10')
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual((200, {'status': 'done', 'data': {'global_mean': 32.9}}), result)
+            pending = webserver.job_registry.create('best5')
+            self.assertEqual((200, {'status': 'running'}),
+                             await call('GET', f'/api/get_results/{pending.job_id}', b'wait=0.05'))
+            self.assertEqual([], pending.callbacks)
+            self.assertEqual((200, {'status': 'error', 'reason': 'Invalid job_id'}),
+                             await call('GET', '/api/get_results/99', b'wait=10'))
+            self.assertEqual((200, {'data': {'a': 1}, 'token': 't'}),
+                             await call('POST', '/api/echo', body=b'{"a": 1}',
+                                        headers=[(b'content-type', b'application/json'),
+                                                 (b'x-token', b't')]))
+
+        async def lifespan():
+            received = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+            messages = []
+
+            async def receive():
+                return next(received)
+
+            async def send(message):
+                messages.append(message['type'])
+
+            await app({'type': 'lifespan'}, receive, send)
+            return messages
+
+        try:
+            asyncio.run(main())
+            self.assertEqual(['lifespan.startup.complete', 'lifespan.shutdown.complete'],
+                             asyncio.run(lifespan()))
+            self.assertTrue(webserver.shutdown)
+            self.assertFalse(any(thread.is_alive() for thread in webserver.tasks_runner.threads))
+        finally:
+            app.executor.shutdown()
+            webserver.tasks_runner.shutdown()
+
+    def test_result_store(self):
+        """
+        Test case for the MemoryResultStore and FileResultStore classes.
+        It checks that results are returned as stored, whole or streamed in chunks, and
+        that the memory store evicts the oldest results once it is full or they have
+        expired.
+        """
+        store = MemoryResultStore(3600, 2)
+        for job_id in range(1, 4):
+            store.put(job_id, b'{"job": %d}' % job_id)
+        self.assertIsNone(store.get(1))
+        self.assertEqual(b'{"job": 3}', store.get(3))
+        self.assertEqual((10, [b'{"job": 3}']), store.stream(3))
+
+        store = MemoryResultStore(0, 2)
+        store.put(1, b'{}')
+        self.assertIsNone(store.get(1))
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = FileResultStore(directory)
+            self.assertIsNone(store.get(1))
+            store.put(1, b'{"global_mean": 32.9}')
+            self.assertEqual(b'{"global_mean": 32.9}', store.get(1))
+            self.assertIsNone(store.stream(2))
+
+            result = b'[' + b'0,' * CHUNK_SIZE + b'0]'
+            store.put(2, result)
+            length, chunks = store.stream(2)
+            chunks = list(chunks)
+            self.assertEqual((len(result), 3), (length, len(chunks)))
+            self.assertEqual(result, b''.join(chunks))
+
+    def test_shared_dataset(self):
+        """
+        Test case for the shared memory dataset.
+        It checks that a frame published to a segment can be attached to with the same
+        contents, that the DataIngestor answers the same way from it, and that a segment
+        removed before it is attached to raises ValueError.
+        """
+        d_i = DataIngestor("unittests/test.csv")
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        name = f'test_dataset_{os.getpid()}'
+        self.assertIsNone(attach_frame(name))
+
+        segment, published = publish_frame(name, DataIngestor.encoded_frame(d_i.d_f))
+        try:
+            attached_segment, attached = attach_frame(name)
+            self.assertTrue(attached.equals(published))
+            self.assertEqual('category', attached['LocationDesc'].dtype)
+
+            shared = DataIngestor("unittests/missing.csv", shared_memory=name)
+            self.assertEqual(0, shared.memory_usage[0])
+            self.assertEqual(d_i.global_mean(question)(), shared.global_mean(question)())
+            del attached, published, shared
+            attached_segment.close()
+
+            with self.assertRaises(ValueError):
+                attach_frame(name, 'other')
+            private = DataIngestor("unittests/test.csv", shared_memory=name)
+            self.assertEqual(('csv', None), (private.loaded_from, private.shared_memory))
+
+            pickled = pickle.dumps(DataIngestor("unittests/missing.csv", shared_memory=name))
+            # The segment is removed between the attempts to create it and to attach to it
+            with mock.patch.object(shared_dataset, 'attach_frame', return_value=None), \
+                    self.assertRaises(ValueError):
+                publish_frame(name, DataIngestor.encoded_frame(d_i.d_f))
+        finally:
+            segment.close()
+            segment.unlink()
+
+        with self.assertRaises(ValueError):
+            pickle.loads(pickled)
+
+    def test_shared_dataset_header(self):
+        """
+        Test case for the checks of the header of a shared memory segment.
+        It checks that attaching to a segment that was not written by publish_frame(),
+        or whose columns do not fit in it, raises ValueError.
+        """
+        name = f'test_header_{os.getpid()}'
+        header = json.dumps({'generation': None, 'rows': 1000, 'columns': [
+            {'name': 'Data_Value', 'dtype': '<f8', 'offset': 0, 'categories': None}]})
+        for magic in [b'\0' * 7, shared_dataset.MAGIC + bytes([shared_dataset.LAYOUT_VERSION])]:
+            segment = shared_memory.SharedMemory(name, create=True, size=1024)
+            try:
+                segment.buf[0] = 1
+                segment.buf[1:8] = magic
+                segment.buf[8:16] = len(header).to_bytes(8, 'little')
+                segment.buf[16:16 + len(header)] = header.encode('utf-8')
+                # As the creator of the segment, keep it registered to the resource tracker
+                with mock.patch.object(shared_dataset, '_published', {name}), \
+                        self.assertRaises(ValueError):
+                    attach_frame(name)
+            finally:
+                segment.close()
+                segment.unlink()
+
+    def test_snapshot(self):
+        """
+        Test case for the binary snapshot of the dataset.
+        It checks that the snapshot is saved on the first load and used on the next one,
+        with the same results, and that it is not used once the CSV file changes.
+        """
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'test.csv')
+            with open("unittests/test.csv", "rb") as f_in, open(csv_path, "wb") as f_out:
+                f_out.write(f_in.read())
+
+            parsed = DataIngestor(csv_path, snapshot_dir=directory)
+            self.assertEqual('csv', parsed.loaded_from)
+            self.assertTrue(os.path.isdir(snapshot_path(directory, csv_path)))
+
+            loaded = DataIngestor(csv_path, snapshot_dir=directory)
+            self.assertEqual('snapshot', loaded.loaded_from)
+            self.assertEqual(parsed.states_mean(question)(), loaded.states_mean(question)())
+            self.assertEqual(parsed.state_mean_by_category(question, 'Ohio')(),
+                             loaded.state_mean_by_category(question, 'Ohio')())
+
+            os.utime(csv_path, ns=(0, 0))
+            self.assertEqual('csv', DataIngestor(csv_path, snapshot_dir=directory).loaded_from)
+            self.assertEqual([os.path.basename(snapshot_path(directory, csv_path))],
+                             [entry for entry in os.listdir(directory) if entry != 'test.csv'])
+
+    def test_append_rows(self):
+        """
+        Test case for appending rows to the dataset.
+        It checks that every endpoint answers the same after appending the second half
+        of the rows to the first half as on the whole dataset, in both dataset modes,
+        and that the dataset the rows were appended to is left unchanged. Rows missing a
+        column or with a numeric column that is not a number are rejected.
+        """
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        rows = pd.read_csv("unittests/test.csv")
+        half = len(rows) // 2
+        queries = [('states_mean', question), ('state_mean', question, 'Ohio'),
+                   ('best5', question), ('worst5', question), ('global_mean', question),
+                   ('diff_from_mean', question), ('state_diff_from_mean', question, 'Ohio'),
+                   ('mean_by_category', question),
+                   ('state_mean_by_category', question, 'Ohio')]
+
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'head.csv')
+            rows.iloc[:half].to_csv(csv_path, index=False)
+            for compact in [False, True]:
+                whole = DataIngestor("unittests/test.csv", compact=compact)
+                head = DataIngestor(csv_path, compact=compact)
+                appended = head.append_rows(rows.iloc[half:])
+
+                self.assertEqual(half, len(head.d_f))
+                self.assertEqual(len(rows), len(appended.d_f))
+                for endpoint, *args in queries:
+                    expected = json.loads(getattr(whole, endpoint)(*args)())
+                    result = json.loads(getattr(appended, endpoint)(*args)())
+                    pd.testing.assert_series_equal(pd.Series(expected), pd.Series(result))
+
+        with self.assertRaises(ValueError):
+            head.append_rows(rows.drop(columns=['Data_Value']))
+        with self.assertRaises(ValueError):
+            head.append_rows(rows.astype({'YearStart': str}).assign(YearStart='abc'))
+
+    def test_serializer(self):
+        """
+        Test case for the JSON serializer.
+        It checks that series are written with the keys and values Series.to_json()
+        writes, with missing labels and values, escaped slashes, non-ASCII labels, tiny
+        values and negative zeros, and that objects go through a dumps/loads round trip
+        unchanged.
+        """
+        def assert_same_json(series):
+            expected, result = json.loads(series.to_json()), json.loads(series_json(series))
+            self.assertEqual(list(expected), list(result))
+            for key, value in expected.items():
+                if value is None:
+                    self.assertIsNone(result[key])
+                else:
+                    self.assertAlmostEqual(value, result[key], places=9)
+
+        index = pd.MultiIndex.from_arrays([[f'{state} {i}' for i in range(40)
+                                            for state in ['Ohio', 'Ohio', 'Iowa', 'Utah']],
+                                           ['Race/Ethnicity', None, 'Income', "O'Neil"] * 40,
+                                           ['Hispanic', 'Total', 'Más', 'Total'] * 40])
+        series = pd.Series([1 / 3, float('nan'), -0.0, 1e6 + 0.25] * 39
+                           + [2.3643e-06, -1e-12, 123.45678901234, 0.0], index=index)
+        assert_same_json(series)
+        series = series.head(4)
+        self.assertEqual(series.to_json(), series_json(series))
+        series.index = series.index.get_level_values(1).fillna('Utah')
+        self.assertEqual(series.to_json(), series_json(series))
+
+        obj = {'status': 'done', 'data': [{'1': 'done'}], 'value': 32.9}
+        self.assertEqual(obj, loads(dumps(obj)))
+        self.assertEqual(b'{"a":1,"b":2}', dumps({'b': 2, 'a': 1}, sort_keys=True))
+
+    def test_metrics(self):
+        """
+        Test case for the Metrics class.
+        It checks the quantiles, sums and counts of the latency summaries, and that jobs
+        which never started are only counted.
+        """
+        metrics = Metrics(4)
+        registry = JobRegistry(metrics)
+        for i in range(6):
+            job = registry.create('best5')
+            registry.start(job.job_id)
+            job.submitted_at, job.started_at = 0.0, float(i)
+            registry.finish(job.job_id)
+        registry.fail(registry.create('best5').job_id)
+
+        self.assertEqual(list(metrics.queue_times['best5']), [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(metrics.sums['best5'][0], 15.0)
+        self.assertEqual(3.0, Metrics.quantile([2.0, 3.0, 4.0, 5.0], 0.5))
+        self.assertEqual(5.0, Metrics.quantile([2.0, 3.0, 4.0, 5.0], 0.99))
+
+        text = metrics.render([('webserver_queue_depth', 'gauge', 'Jobs queued.', 3)])
+        self.assertIn('webserver_job_queue_seconds{endpoint="best5",quantile="0.5"} 3.0', text)
+        self.assertIn('webserver_job_queue_seconds_count{endpoint="best5"} 6', text)
+        self.assertIn('webserver_jobs_total{endpoint="best5",status="done"} 6', text)
+        self.assertIn('webserver_jobs_total{endpoint="best5",status="error"} 1', text)
+        self.assertIn('# TYPE webserver_queue_depth gauge\nwebserver_queue_depth 3\n', text)
+
+    def test_priority_queue(self):
+        """
+        Test case for the priority scheduling of the ThreadPool.
+        It checks that urgent jobs go first, and that old jobs go before newer, more
+        urgent ones once they waited long enough. No dataset is set, so the jobs stay
+        in the queue.
+        """
+        pool = ThreadPool(JobRegistry(), MemoryResultStore(60, 10))
+        try:
+            pool.priority_aging = 10
+            for priority in [3, 0, 3, 1]:
+                pool.submit('best5', None, priority)
+            order = [pool.queue.get_nowait()[2] for _ in range(4)]
+            self.assertEqual([2, 4, 1, 3], order)
+
+            pool.priority_aging = 0.001
+            pool.submit('best5', None, 3)
+            time.sleep(0.01)
+            pool.submit('best5', None, 0)
+            order += [pool.queue.get_nowait()[2] for _ in range(2)]
+            self.assertEqual([5, 6], order[4:])
+            self.assertEqual(0, DataIngestor.cost_class('state_mean', 'q', 'Utah'))
+            self.assertEqual(3, DataIngestor.cost_class('batch', ('best5', 'q'),
+                                                        ('mean_by_category', 'q')))
+        finally:
+            for _ in order:
+                pool.queue.task_done()
+            pool.shutdown()
+
+    @classmethod
+    def setUpClass(cls):
+        # The logger of the webserver is set up once, by the first test creating one
+        cls.log_dir = cls.enterClassContext(tempfile.TemporaryDirectory())
+
+    def create_test_app(self, dataset_path='unittests/test.csv', wait=True, **env):
+        """
+        Creates a webserver answering from a dataset (unittests/test.csv by default),
+        with the given environment variables set for the duration of the test, and
+        waits until its dataset is loaded, unless wait is False. Its threads are shut
+        down at the end of the test. It logs to a temporary directory, not to the
+        webserver.log of the repository.
+        """
+        env.setdefault('LOG_FILE', os.path.join(self.log_dir, 'webserver.log'))
+        self.enterContext(mock.patch.dict(os.environ, env))
+        self.enterContext(mock.patch('app.DATASET_PATH', dataset_path))
+        webserver = create_app()
+        self.addCleanup(webserver.tasks_runner.shutdown)
+        if wait:
+            webserver.dataset_loader.join()
+        return webserver
+
+    def test_request_logging(self):
+        """
+        Test case for the logging of the requests.
+        It checks that the records are written to LOG_FILE by the QueueListener thread,
+        and that with LOG_POLL_SAMPLE_RATE=0 the POST requests are logged while the
+        get_results polls are not.
+        """
+        log_file = os.path.join(self.log_dir, 'sampled.log')
+        # The logger is only set up if it has no handler yet
+        with mock.patch.object(logging.getLogger('webserver'), 'handlers', []), \
+                mock.patch('app.atexit.register') as register:
+            webserver = self.create_test_app(LOG_FILE=log_file, LOG_POLL_SAMPLE_RATE='0')
+            client = webserver.test_client()
+            body = {'question': "Percent of adults who engage in no leisure-time physical activity",
+                    'sync': True}
+            job_id = client.post('/api/best5', json=body).json['job_id']
+            for _ in range(3):
+                self.assertEqual('done', client.get(f'/api/get_results/{job_id}').json['status'])
+
+            # Stopping the listener writes the queued records
+            stop_listener = register.call_args.args[0]
+            stop_listener()
+            stop_listener.__self__.handlers[0].close()
+
+        with open(log_file, encoding='utf-8') as f_in:
+            log = f_in.read()
+        self.assertIn('INFO - POST http://localhost/api/best5', log)
+        self.assertNotIn('/api/get_results', log)
+
+    def test_cached_result_route(self):
+        """
+        Test case for a request answered from the result cache.
+        It checks that the route answers with the data right away, alongside a new
+        job ID, instead of asking the client to poll for it.
+        """
+        client = self.create_test_app(SYNC_FAST_PATH='0').test_client()
+        body = {'question': "Percent of adults who engage in no leisure-time physical activity"}
+
+        first = client.post('/api/best5', json=body).json
+        self.assertEqual('running', first['status'])
+        result = client.get(f"/api/get_results/{first['job_id']}?wait=10").json
+        self.assertEqual('done', result['status'])
+
+        second = client.post('/api/best5', json=body).json
+        self.assertEqual({'status': 'done', 'job_id': first['job_id'] + 1,
+                          'data': result['data']}, second)
+
+    def test_wait_route(self):
+        """
+        Test case for the '?wait=' long-polling mode of the get_results route.
+        It checks that a waiting request is answered as soon as its job is done, and
+        that the wait is capped at MAX_RESULT_WAIT seconds.
+        """
+        webserver = self.create_test_app()
+        client = webserver.test_client()
+        job = webserver.job_registry.create('global_mean')
+
+        def finish():
+            webserver.result_store.put(job.job_id, b'{"global_mean": 32.9}')
+            webserver.job_registry.finish(job.job_id)
+
+        threading.Timer(0.1, finish).start()
+        start = time.monotonic()
+        result = client.get(f'/api/get_results/{job.job_id}?wait=10').json
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual({'status': 'done', 'data': {'global_mean': 32.9}}, result)
+
+        job = webserver.job_registry.create('global_mean')
+        with mock.patch('app.routes.MAX_RESULT_WAIT', 0.2):
+            start = time.monotonic()
+            result = client.get(f'/api/get_results/{job.job_id}?wait=60').json
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual({'status': 'running'}, result)
+
+    def test_failed_inline_job(self):
+        """
+        Test case for a request computed inline whose computation raises.
+        It checks that the job is reported as failed, by the route and by get_results,
+        and that it is no longer counted as running.
+        """
+        webserver = self.create_test_app()
+        client = webserver.test_client()
+        body = {'question': "Percent of adults who engage in no leisure-time physical activity",
+                'sync': True}
+
+        with mock.patch.object(webserver.data_ingestor, 'best5', side_effect=ValueError):
+            result = client.post('/api/best5', json=body)
+        self.assertEqual(200, result.status_code)
+        self.assertEqual({'status': 'error', 'job_id': 1, 'reason': 'Job failed'}, result.json)
+        self.assertEqual({'status': 'error', 'reason': 'Job failed'},
+                         client.get('/api/get_results/1').json)
+        self.assertEqual({'status': 'done', 'data': [{'1': 'error'}]},
+                         client.get('/api/jobs').json)
+        self.assertEqual({'num_jobs': 0}, client.get('/api/num_jobs').json)
+
+    def test_batch_route(self):
+        """
+        Test case for the validation of the queries of the batch route.
+        It checks that queries with an unknown endpoint, a missing or an extra state,
+        or a non-string argument are rejected without creating a job, and that a
+        valid batch is answered.
+        """
+        webserver = self.create_test_app()
+        client = webserver.test_client()
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+
+        for queries in [None, [{'endpoint': 'median', 'question': question}],
+                        [{'endpoint': 'state_mean', 'question': question}],
+                        [{'endpoint': 'best5', 'question': question, 'state': 'Utah'}],
+                        [{'endpoint': 'best5'}], [{'endpoint': 'best5', 'question': 1}],
+                        ['best5']]:
+            for sync in [False, True]:
+                result = client.post('/api/batch', json={'queries': queries, 'sync': sync})
+                self.assertEqual(200, result.status_code)
+                self.assertEqual('error', result.json['status'])
+        self.assertEqual({'status': 'done', 'data': []}, client.get('/api/jobs').json)
+
+        result = client.post('/api/batch', json={'sync': True, 'queries': [
+            {'endpoint': 'best5', 'question': question},
+            {'endpoint': 'state_mean', 'question': question, 'state': 'Wisconsin'}]}).json
+        self.assertEqual('done', result['status'])
+        data_ingestor = webserver.data_ingestor
+        self.assertEqual([json.loads(data_ingestor.best5(question)()),
+                          json.loads(data_ingestor.state_mean(question, 'Wisconsin')())],
+                         result['data'])
+
+    def test_full_queue_route(self):
+        """
+        Test case for the rejection of the jobs submitted while the job queue is full.
+        The dataset is never loaded, so the queued jobs are never run. It checks that
+        the rejected request gets a 429 response with a Retry-After header, that it is
+        counted by the metrics, and that it leaves no gap in the job IDs.
+        """
+        with mock.patch('app.dataset_loader.DatasetLoader.run'):
+            webserver = self.create_test_app(wait=False, TP_MAX_QUEUE_SIZE='2')
+        client = webserver.test_client()
+        queue = webserver.tasks_runner.queue
+
+        def drain():
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+
+        self.addCleanup(drain)
+        body = {'question': "Percent of adults who engage in no leisure-time physical activity"}
+
+        self.assertEqual([1, 2], [client.post('/api/best5', json=body).json['job_id']
+                                  for _ in range(2)])
+        result = client.post('/api/best5', json=body)
+        self.assertEqual(429, result.status_code)
+        self.assertEqual('1', result.headers['Retry-After'])
+        self.assertEqual({'status': 'error', 'reason': 'Too many jobs queued'}, result.json)
+        self.assertIn('\nwebserver_rejected_jobs_total 1\n',
+                      client.get('/api/metrics').get_data(as_text=True))
+
+        queue.get_nowait()
+        queue.task_done()
+        self.assertEqual(3, client.post('/api/best5', json=body).json['job_id'])
+        self.assertEqual({'num_jobs': 3}, client.get('/api/num_jobs').json)
+
+    def test_job_eviction(self):
+        """
+        Test case for the eviction of the ended jobs from the JobRegistry.
+        It checks that only the last max_done_jobs ended jobs are kept, that running
+        jobs are never evicted, that the results of the evicted jobs are deleted,
+        from both result stores, and that their IDs are eventually dropped.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            for store in [MemoryResultStore(60, 10), FileResultStore(directory)]:
+                registry = JobRegistry(max_done_jobs=2, result_store=store)
+                jobs = [registry.create('best5') for _ in range(5)]
+                for job in jobs[1:]:
+                    store.put(job.job_id, b'{}')
+                    registry.finish(job.job_id)
+
+                self.assertEqual([1, 4, 5], [job.job_id for job in registry.page(0, None)])
+                self.assertEqual([4], [job.job_id for job in registry.page(1, 1)])
+                self.assertEqual([4, 5], [job.job_id for job in registry.page(2, None)])
+                self.assertIsNone(registry.get(2))
+                self.assertEqual([None, None, b'{}', b'{}'],
+                                 [store.get(job_id) for job_id in range(2, 6)])
+                self.assertEqual((1, 4), (registry.running_jobs, registry.done_jobs))
+
+                registry.finish(1)
+                self.assertEqual([1, 5], [job.job_id for job in registry.page(0, None)])
+                # The evicted IDs outnumber the kept ones, so they are dropped
+                self.assertEqual([1, 5], registry.job_ids)
+
+    def test_process_executor(self):
+        """
+        Test case for the process-pool backend of the ThreadPool.
+        It checks that jobs computed by the worker processes answer like the dataset
+        itself, and that replacing the dataset sends the new one to the same worker
+        processes instead of starting new ones.
+        """
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        with mock.patch.dict(os.environ, {'TP_EXECUTOR': 'process', 'TP_NUM_OF_THREADS': '2'}):
+            pool = ThreadPool(JobRegistry(), MemoryResultStore(60, 10))
+        try:
+            d_i = DataIngestor("unittests/test.csv")
+            pool.set_data_ingestor(d_i)
+            executor = pool.executor
+            jobs = [pool.job('state_mean', question, 'Wisconsin'), pool.job('best5', question)]
+            self.assertEqual([d_i.state_mean(question, 'Wisconsin')(), d_i.best5(question)()],
+                             [job() for job in jobs])
+
+            rows = pd.read_csv("unittests/test.csv")
+            rows = rows[rows['LocationDesc'] == 'Wisconsin'].assign(Data_Value=100.0)
+            appended = d_i.append_rows(rows)
+            pool.set_data_ingestor(appended)
+            self.assertIs(executor, pool.executor)
+            for _ in range(2):
+                self.assertEqual([appended.state_mean(question, 'Wisconsin')(),
+                                  appended.best5(question)()],
+                                 [job() for job in jobs])
+            self.assertNotEqual(d_i.best5(question)(), jobs[1]())
+
+            job_id = pool.submit('best5', lambda: jobs[1]().encode('utf-8'))
+            pool.job_registry.wait(job_id, 10)
+            self.assertEqual(appended.best5(question)().encode('utf-8'),
+                             pool.result_store.get(job_id))
+        finally:
+            pool.shutdown()
+
+    def test_ready_route(self):
+        """
+        Test case for the ready route while the dataset is loading.
+        It checks that the route answers 503 with a Retry-After header until the
+        dataset is loaded, that jobs submitted meanwhile are run once it is, and that
+        the route then reports the server as ready.
+        """
+        loaded = threading.Event()
+
+        def load(*args, **kwargs):
+            loaded.wait(10)
+            return DataIngestor(*args, **kwargs)
+
+        with mock.patch('app.data_ingestor.DataIngestor', side_effect=load):
+            webserver = self.create_test_app(wait=False)
+            client = webserver.test_client()
+            result = client.get('/api/ready')
+            self.assertEqual(503, result.status_code)
+            self.assertEqual('1', result.headers['Retry-After'])
+            self.assertEqual({'status': 'loading'}, result.json)
+
+            question = "Percent of adults aged 18 years and older who have an overweight classification"
+            job_id = client.post('/api/global_mean', json={'question': question}).json['job_id']
+            self.assertEqual({'status': 'running'},
+                             client.get(f'/api/get_results/{job_id}?wait=0.1').json)
+
+            loaded.set()
+            webserver.dataset_loader.join()
+        self.assertEqual(200, client.get('/api/ready').status_code)
+        self.assertEqual({'status': 'ready'}, client.get('/api/ready').json)
+        self.assertEqual({'status': 'done',
+                          'data': json.loads(webserver.data_ingestor.global_mean(question)())},
+                         client.get(f'/api/get_results/{job_id}?wait=10').json)
+
+    def test_failed_load_route(self):
+        """
+        Test case for a dataset that cannot be loaded.
+        It checks that the ready route reports the error, that the jobs submitted
+        before and after the load failed end as failed instead of running forever, and
+        that the server then shuts down without waiting for them.
+        """
+        loaded = threading.Event()
+
+        def load(*args, **kwargs):
+            loaded.wait(10)
+            return DataIngestor(*args, **kwargs)
+
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        with mock.patch('app.data_ingestor.DataIngestor', side_effect=load):
+            webserver = self.create_test_app('unittests/missing.csv', wait=False)
+            client = webserver.test_client()
+            # The priority is given, as DataIngestor.cost_class is mocked too
+            queued = client.post('/api/global_mean',
+                                 json={'question': question, 'priority': 0}).json
+            self.assertEqual('running', queued['status'])
+
+            loaded.set()
+            webserver.dataset_loader.join()
+        result = client.get('/api/ready')
+        self.assertEqual(503, result.status_code)
+        self.assertEqual('error', result.json['status'])
+
+        job_id = client.post('/api/global_mean', json={'question': question}).json['job_id']
+        for job_id in [queued['job_id'], job_id]:
+            self.assertEqual({'status': 'error', 'reason': 'Job failed'},
+                             client.get(f'/api/get_results/{job_id}?wait=10').json)
+
+        shutdown = threading.Thread(target=client.get, args=('/api/graceful_shutdown',))
+        shutdown.start()
+        shutdown.join(10)
+        self.assertFalse(shutdown.is_alive())
+
+    def test_reload_route(self):
+        """
+        Test case for the reload route.
+        It checks that a reload without the admin token answers 403, that a reload
+        answers 409 while another one is running, that the current dataset keeps
+        answering meanwhile, and that the reloaded dataset is then swapped in, with the
+        results cached before the reload dropped.
+        """
+        csv_path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'data.csv')
+        rows = pd.read_csv("unittests/test.csv")
+        rows.to_csv(csv_path, index=False)
+        webserver = self.create_test_app(csv_path, ADMIN_TOKEN='secret')
+        client = webserver.test_client()
+        admin = {'X-Admin-Token': 'secret'}
+        for headers in [{}, {'X-Admin-Token': 'wrong'}]:
+            result = client.post('/api/admin/reload', headers=headers)
+            self.assertEqual(403, result.status_code)
+            self.assertEqual({'status': 'error', 'reason': 'Forbidden'}, result.json)
+
+        body = {'question': "Percent of adults aged 18 years and older who have an overweight classification",
+                'sync': True}
+        before = client.post('/api/global_mean', json=body).json['data']
+
+        rows.assign(Data_Value=rows['Data_Value'] + 10).to_csv(csv_path, index=False)
+        loaded = threading.Event()
+
+        def load(*args, **kwargs):
+            loaded.wait(10)
+            return DataIngestor(*args, **kwargs)
+
+        with mock.patch('app.data_ingestor.DataIngestor', side_effect=load):
+            self.assertEqual({'status': 'reloading'},
+                             client.post('/api/admin/reload', headers=admin).json)
+            result = client.post('/api/admin/reload', headers=admin)
+            self.assertEqual(409, result.status_code)
+            self.assertEqual('error', result.json['status'])
+            self.assertEqual(before,
+                             client.post('/api/global_mean', json=body).json['data'])
+
+            loaded.set()
+            webserver.dataset_loader.join()
+        after = client.post('/api/global_mean', json=body).json['data']
+        self.assertAlmostEqual(before['global_mean'] + 10, after['global_mean'])
+
+    def test_append_route(self):
+        """
+        Test case for the append route, with the process-pool backend.
+        It checks that the route is disabled without ADMIN_TOKEN, that invalid rows are
+        rejected with a 400 and leave the file alone, and that appended rows are written
+        to the file and seen by the next jobs, computed by the same worker processes.
+        """
+        csv_path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'data.csv')
+        rows = pd.read_csv("unittests/test.csv")
+        rows.to_csv(csv_path, index=False)
+        webserver = self.create_test_app(csv_path, TP_EXECUTOR='process', TP_NUM_OF_THREADS='2',
+                                         ADMIN_TOKEN='secret')
+        client = webserver.test_client()
+        executor = webserver.tasks_runner.executor
+        question = "Percent of adults aged 18 years and older who have an overweight classification"
+        admin = {'X-Admin-Token': 'secret'}
+        appended = rows[rows['LocationDesc'] == 'Wisconsin'].assign(Data_Value=100.0)
+
+        with mock.patch.object(webserver, 'admin_token', None):
+            result = client.post('/api/admin/append', data=appended.to_csv(index=False))
+        self.assertEqual(403, result.status_code)
+        self.assertEqual(len(rows), len(pd.read_csv(csv_path)))
+
+        for data in ['LocationDesc,Question\nWisconsin,q\n',
+                     appended.assign(YearStart='abc').to_csv(index=False)]:
+            result = client.post('/api/admin/append', data=data, headers=admin)
+            self.assertEqual(400, result.status_code)
+            self.assertEqual('error', result.json['status'])
+            self.assertEqual(len(rows), len(pd.read_csv(csv_path)))
+
+        result = client.post('/api/admin/append', data=appended.to_csv(index=False),
+                             headers=admin)
+        self.assertEqual({'status': 'done', 'rows': len(appended)}, result.json)
+        self.assertEqual(len(rows) + len(appended), len(pd.read_csv(csv_path)))
+
+        expected = DataIngestor(csv_path)
+        job_id = client.post('/api/states_mean', json={'question': question}).json['job_id']
+        self.assertEqual({'status': 'done', 'data': json.loads(expected.states_mean(question)())},
+                         client.get(f'/api/get_results/{job_id}?wait=10').json)
+        self.assertIs(executor, webserver.tasks_runner.executor)
+
     if __name__ == '__main__':
         unittest.main()